@@ -1,3 +1,4 @@
+import sys, os
 from rdkit import Chem
 from rdkit.Chem.rdchem import EditableMol
 from rdkit.Chem.rdchem import Atom
@@ -5,6 +6,8 @@ from rdkit.Chem.Draw import IPythonConsole
 from rdkit.Chem.Draw import ShowMol
 from showmols import ShowMols
 from copy import deepcopy
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'MarkInChI'))
+from layers import InChILayers
 
 INCHI_NON_METALS = [
     1,  2,  5,  6, 
@@ -230,32 +233,12 @@ class MarkMol3000(object):
         # Removes isotope labels for the pseudoatoms from inchi
         # indices gives the canonical index of the pseudoatoms
 
-        inchi_parts = inchi.split("/")
-        new_inchi = ""
-        for inchi_part in inchi_parts:
-            if inchi_part[0] != "i":
-                new_inchi += inchi_part
-                new_inchi += "/"
-            else:
-                isotope_layer = "i"
-                fragments = inchi_part.split("i")[1].split(",")
-                for fragment in fragments:
-                    if fragment.find("+") != -1:
-                        idx = fragment.split("+")[0]
-                        if int(idx) not in indices:
-                            isotope_layer += fragment
-                            isotope_layer += ","
-                    else:
-                        idx = fragment.split("-")[0]
-                        if int(idx) not in indices:
-                            isotope_layer += fragment
-                            isotope_layer += ","
-                if isotope_layer != "i":
-                    isotope_layer = isotope_layer[:len(isotope_layer)-1]
-                    new_inchi += isotope_layer
-                    new_inchi += "/"
-        new_inchi = new_inchi[:len(new_inchi) - 1]
-        return new_inchi
+        layers = InChILayers(inchi)
+        isotopes = layers.isotopes()
+        for idx in indices:
+            isotopes.pop(idx, None)
+        layers.set_isotopes(isotopes)
+        return str(layers)
 
     def sort_rgroups(self, rgroups):
         rgroup_mapping = {}
@@ -0,0 +1,253 @@
+import sys, os
+import time
+from rdkit import Chem, RDLogger
+from markinchi import MarkInChI, OUTPUTS, core_cache, cache_info
+
+# This module times the stages of the expansion of markinchis on a file of
+# reference markinchis (one "MarkInChI=..." per line, by default the
+# Structures_for_testing references), e.g.
+#     python benchmark.py finalise [file]
+# Times of a stage are given in microseconds per member.
+
+default_file = os.path.join(os.path.dirname(__file__), "Structures_for_testing",
+                            "Reference_MarkInChIs_testing.txt")
+
+def load_markinchis(path=default_file):
+
+    # Markinchis of a file, in order and without repetitions
+    markinchis = []
+    with open(path) as file:
+        for line in file:
+            index = line.find("MarkInChI=")
+            if index != -1:
+                markinchi = line[index:].split()[0]
+                if markinchi not in markinchis:
+                    markinchis.append(markinchi)
+    return markinchis
+
+def finished_molecules(inchi_obj):
+
+    # Molecules of every combination expanded by run(), once all the
+    # substitutions are done and before they are finalised
+    molecules = []
+    sizes = [len(grouplist) for grouplist in inchi_obj.grouplists]
+    total = 1
+    for size in sizes:
+        total *= size
+    for k in range(total if len(sizes) > 0 else 0):
+        choices = inchi_obj.decode(k)
+        if inchi_obj.is_skipped(choices):
+            continue
+        new_mol = inchi_obj.core_mol
+        for grouplist, choice in zip(inchi_obj.grouplists, choices):
+            new_mol = inchi_obj.substitute(new_mol, grouplist[choice])
+        molecules.append(new_mol)
+    return molecules
+
+def timed(times, stage, function, *args):
+
+    # Call function adding its time to times[stage]
+    start = time.perf_counter()
+    result = function(*args)
+    times[stage] = times.get(stage, 0) + time.perf_counter()-start
+    return result
+
+def benchmark_finalise(markinchis):
+
+    """ Times the finalisation of every member: the stages done for every
+        member before (sanitize_labels, sanitize, MolToInchi and the unused
+        MolFromInchi) and MarkInChI.finalise for every output format. """
+
+    objects = []
+    for markinchi in markinchis:
+        try:
+            inchi_obj = MarkInChI(markinchi, lazy=True)
+            objects.append((inchi_obj, finished_molecules(inchi_obj)))
+        except Exception as error:
+            print(f"skipped {markinchi}: {error!r}")
+    count = sum(len(molecules) for inchi_obj, molecules in objects)
+    before = {}
+    after = {}
+    for inchi_obj, molecules in objects:
+        label = inchi_obj.label
+        for new_mol in molecules:
+            new_mol = timed(before, "sanitize_labels", label.sanitize_labels,
+                            inchi_obj.ranks, inchi_obj.inchi, new_mol)
+            new_mol = timed(before, "sanitize", label.sanitize, new_mol)
+            new_inchi = timed(before, "MolToInchi", Chem.MolToInchi, new_mol)
+            timed(before, "MolFromInchi", Chem.MolFromInchi, new_inchi)
+        for output in OUTPUTS:
+            for new_mol in molecules:
+                timed(after, output, inchi_obj.finalise, new_mol, output)
+    print(f"{len(objects)} markinchis, {count} members (before removing duplicates)")
+    print("before (us/member):")
+    for stage, seconds in before.items():
+        print(f"    {stage}: {seconds/count*1e6:.1f}")
+    print(f"    total: {sum(before.values())/count*1e6:.1f}")
+    print("finalise (us/member):")
+    for output, seconds in after.items():
+        print(f"    {output}: {seconds/count*1e6:.1f}")
+
+# Markinchis whose symmetric attachments must not be pruned, checked by
+# benchmark_symmetry with the markinchis given: atoms only told apart by an
+# isotope of the core
+symmetry_checks = ["MarkInChI=1B/C6H5Cl/c7-6-4-2-1-3-5-6/h1-5H/i4+1<M>2H,3H-O!N"]
+
+def benchmark_symmetry(markinchis):
+
+    """ Counts the members converted (inchis generated, by run() or by the
+        smiles template, see MarkInChI.convert) by the expansion with and
+        without the pruning of symmetric substitutions, and times both
+        expansions. The members of every markinchi (and of
+        symmetry_checks) must be the same with and without pruning. """
+
+    markinchis = markinchis + [markinchi for markinchi in symmetry_checks
+                               if markinchi not in markinchis]
+    members = {}  # {(markinchi, symmetry): set of members}
+    for symmetry in (False, True):
+        generated = 0
+        produced = 0
+        seconds = 0
+        for markinchi in markinchis:
+            try:
+                start = time.perf_counter()
+                inchi_obj = MarkInChI(markinchi, lazy=True, symmetry=symmetry)
+                convert = inchi_obj.convert
+                calls = []
+                def counted(new_mol, output=None):
+                    calls.append(1)
+                    return convert(new_mol, output)
+                inchi_obj.convert = counted
+                inchis = list(inchi_obj.iter_inchis())
+                members[(markinchi, symmetry)] = set(inchis)
+                produced += len(inchis)
+                seconds += time.perf_counter()-start
+                generated += len(calls)
+            except Exception as error:
+                if symmetry:
+                    print(f"skipped {markinchi}: {error!r}")
+        pruning = "with" if symmetry else "without"
+        print(f"{pruning} symmetry pruning: {generated} inchis generated, "
+              f"{produced} different, {seconds:.2f} s")
+    for markinchi in markinchis:
+        if members.get((markinchi, False)) != members.get((markinchi, True)):
+            print(f"different members with symmetry pruning: {markinchi}")
+
+def benchmark_cores(markinchis):
+
+    """ Times the preparation of the MarkInChI instances (lazy, so nothing
+        is expanded) with the core cache emptied before every markinchi
+        and with the cache kept, and gives the statistics of the caches. """
+
+    markinchis = [markinchi for markinchi in markinchis
+                  if markinchi.find("<M>") != -1]
+    for cached in (False, True):
+        core_cache.clear()
+        seconds = 0
+        for markinchi in markinchis:
+            if not cached:
+                core_cache.clear()
+            start = time.perf_counter()
+            try:
+                MarkInChI(markinchi, lazy=True, symmetry=False)
+            except Exception as error:
+                if cached:
+                    print(f"skipped {markinchi}: {error!r}")
+            seconds += time.perf_counter()-start
+        cache = "with" if cached else "without"
+        print(f"{cache} core cache: {seconds/len(markinchis)*1e6:.0f} "
+              f"us/markinchi")
+    print(cache_info())
+
+def large_cores(sizes=(120, 240, 480)):
+
+    # Synthetic markinchis with large cores: an alkane of n carbons with a
+    # variable attachment on every other carbon and a Zz atom at the end
+    markinchis = []
+    for n in sizes:
+        mol = Chem.MolFromSmiles("C"*n+"[Te]")
+        inchi = Chem.MolToInchi(mol).replace("InChI=1S", "MarkInChI=1B")
+        inchi = inchi.replace("Te", "Zz")
+        attachments = ",".join(f"{rank}H" for rank in range(2, n, 2))
+        markinchis.append(f"{inchi}<M>{attachments}-C!N<M>Cl!H")
+    return markinchis
+
+def benchmark_layers(markinchis):
+
+    """ Times the inchi string operations of the labelling on cores with
+        100+ atoms (see large_cores, the markinchis given are not used):
+        zz_to_te, label_inchi (all the labels written at once) and the
+        lookup of every label in the parsed isotopic layer (as done by
+        sanitize_labels). """
+
+    from label import Label
+    from plan import Plan
+    from zz_convert import zz_convert
+    from layers import InChILayers
+    label = Label()
+    zz = zz_convert()
+    for markinchi in large_cores():
+        plan = Plan(markinchi)
+        times = {}
+        start = time.perf_counter()
+        core = zz.zz_to_te(plan.core)
+        times["zz_to_te"] = time.perf_counter()-start
+        inchiplus = [block.text.replace("Zz", "Te") for block in plan.blocks]
+        start = time.perf_counter()
+        labelled, ranks = label.label_inchi(core, inchiplus)
+        times["label_inchi"] = time.perf_counter()-start
+        start = time.perf_counter()
+        isotopes = InChILayers(labelled).isotopes()
+        for rank in ranks:
+            isotopes.get(int(rank))
+        times["isotope lookups"] = time.perf_counter()-start
+        start = time.perf_counter()
+        str(InChILayers(labelled))
+        times["parse+serialize"] = time.perf_counter()-start
+        atoms = len(InChILayers(core).layer("c").replace("(", "-").split("-"))
+        print(f"core of ~{atoms} atoms, {len(ranks)} labels: " + ", ".join(
+            f"{name} {seconds*1e3:.2f} ms" for name, seconds in times.items()))
+
+def large_rings(sizes=(120, 240, 480)):
+
+    # Synthetic markinchis with large cores: a ring of n carbons with a Zz
+    # atom, a variable attachment of Br or ethyl on 8 atoms spread over the
+    # ring (ranks too high for isotope labels included, see
+    # label.isotopes_fit) and Cl or H on Zz
+    markinchis = []
+    for n in sizes:
+        mol = Chem.MolFromSmiles("C1"+"C"*(n-2)+"C1[Te]")
+        inchi = Chem.MolToInchi(mol).replace("InChI=1S", "MarkInChI=1B")
+        inchi = inchi.replace("Te", "Zz")
+        attachments = ",".join(f"{rank}H" for rank in range(n//8, n, n//8))
+        markinchis.append(f"{inchi}<M>{attachments}-Br!C2H5Zz/c1-2-3/h2H2,1H3"
+                          f"<M>Cl!H")
+    return markinchis
+
+def benchmark_large(markinchis):
+
+    """ Times the expansion of markinchis with large cores (see large_rings,
+        the markinchis given are not used), which are labelled with atom
+        map numbers (see label.Label.label_mol). """
+
+    for markinchi in large_rings():
+        core_cache.clear()
+        start = time.perf_counter()
+        inchi_obj = MarkInChI(markinchi, lazy=True)
+        prepared = time.perf_counter()-start
+        members = list(inchi_obj.iter_inchis())
+        seconds = time.perf_counter()-start
+        atoms = inchi_obj.core_mol.GetNumAtoms()
+        print(f"core of {atoms} atoms ({inchi_obj.labelling} labelling): "
+              f"{len(members)} members, core {prepared*1e3:.0f} ms, "
+              f"{(seconds-prepared)/len(members)*1e3:.1f} ms/member")
+
+benchmarks = {"finalise": benchmark_finalise, "symmetry": benchmark_symmetry,
+              "cores": benchmark_cores, "layers": benchmark_layers,
+              "large": benchmark_large}
+
+if __name__ == "__main__":
+    RDLogger.DisableLog("rdApp.*")
+    name = sys.argv[1] if len(sys.argv) > 1 else "finalise"
+    path = sys.argv[2] if len(sys.argv) > 2 else default_file
+    benchmarks[name](load_markinchis(path))
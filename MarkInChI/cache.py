@@ -0,0 +1,58 @@
+import threading
+from collections import OrderedDict
+
+# This module contains the cache used to keep objects that are expensive to
+# build (e.g. RDKit molecules of substituents) between substitutions and
+# between MarkInChI instances of the same process.
+
+class LRUCache(object):
+
+    """ Bounded cache that drops the least recently used item when more
+        than maxsize items are stored. hits and misses count the calls to
+        get() that found or didn't find the key. Stored values are shared,
+        so they should not be modified by the callers. The cache can be
+        used by several threads at once. """
+
+    def __init__(self, maxsize=1024):
+
+        self.maxsize = maxsize
+        self.items = OrderedDict()  # {key: value}, least recent first
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+
+        with self.lock:
+            if key in self.items:
+                self.hits += 1
+                self.items.move_to_end(key)
+                return self.items[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def clear(self):
+
+        with self.lock:
+            self.items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+
+        # Statistics of the cache
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "size": len(self.items), "maxsize": self.maxsize}
+
+    def __len__(self):
+
+        return len(self.items)
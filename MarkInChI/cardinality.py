@@ -0,0 +1,44 @@
+from plan import Plan
+from validate import validate
+
+# This module counts the single inchis a markinchi expands to without
+# producing them. It only works on the markinchi string, so it doesn't
+# import RDKit and can be used before starting a (long) expansion.
+
+class Cardinality(object):
+
+    """ This class counts the substitutions of every block of a markinchi
+        (see plan.Plan):
+        - R group e.g. "C!Cl!H": one substitution per item
+        - list of atoms e.g. "1-C!N": one substitution per atom
+        - variable attachment e.g. "1H,2H,4H-C!N": one substitution per
+          attachment and substituent
+        total is the product of the block sizes. It is an upper bound of
+        len(MarkInChI(markinchi).list_of_inchi) as duplicates and repeated
+        attachments are removed during the expansion. """
+
+    def __init__(self, markinchi):
+
+        validate(markinchi)  # raises MarkInChISyntaxError
+        self.plan = Plan(markinchi)
+        self.core = self.plan.core
+        self.blocks = []  # breakdown of every block (list of dict)
+        for block in self.plan.blocks:
+            self.blocks.append({
+                "block": block.text, "type": block.kind,
+                "attachments": block.attachments,  # [(rank, hydrogen)]
+                "substituents": [sub.text for sub in block.substituents],
+                "size": block.size()})
+        self.total = self.plan.total()  # upper bound of the number of inchis
+
+    def sizes(self):
+
+        # Number of substitutions of every block
+        return self.plan.sizes()
+
+if __name__ == "__main__":
+    markinchi = input("Please enter the MarkInChI: ")
+    count = Cardinality(markinchi)
+    for block in count.blocks:
+        print(f"{block['type']}: {block['block']} - {block['size']}")
+    print(f"Maximum number of inchi produced: {count.total}")
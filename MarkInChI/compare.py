@@ -1,6 +1,11 @@
-from markinchi import MarkInChI
+from validate import validate
 class compare_markinchi(object):
     def __init__(self, inchi1, inchi2):
+        # both are checked before the first is expanded
+        validate(inchi1)
+        validate(inchi2)
+        # RDKit is only imported once both are valid
+        from markinchi import MarkInChI
         markinchi1 = MarkInChI(inchi1).list_of_inchi
         markinchi2 = MarkInChI(inchi2).list_of_inchi
         set_markinchi1 = []
@@ -0,0 +1,159 @@
+import sys, os
+import bisect
+import hashlib
+import heapq
+import mmap
+import tempfile
+from rdkit import Chem
+
+# This module removes the duplicates of a stream of members (inchis,
+# inchikeys or smiles) keeping only a fixed-width key of every member. The
+# keys are kept in a set until a memory budget is exceeded, then they are
+# written to a new sorted run file on disk (runs of the same size are merged,
+# so every key is rewritten only a logarithmic number of times) and the runs
+# are searched by bisection, so libraries of millions of members can be
+# deduplicated in bounded memory.
+
+KEY_WIDTHS = {"inchikey": 27, "hash": 8}  # bytes of a key
+
+def inchikey(member):
+
+    # InChIKey of an inchi (inchikeys are kept as they are). A member that
+    # gives no inchikey (e.g. the empty inchi of a molecule RDKit couldn't
+    # convert) is keyed by "#" and a hash of 26 lowercase hex digits, which
+    # has the width of an inchikey and can't be one
+    if member.startswith("InChI="):
+        member = Chem.InchiToInchiKey(member) or ""
+    if len(member) != KEY_WIDTHS["inchikey"]:
+        digest = hashlib.blake2b(member.encode(), digest_size=13).hexdigest()
+        member = "#" + digest
+    return member.encode("ascii")
+
+def hash64(member):
+
+    # 64-bit hash of a string, the same in every process
+    return hashlib.blake2b(member.encode(), digest_size=8).digest()
+
+class RunFile(object):
+
+    """ Sorted file of fixed-width keys, read as a sequence of keys (so
+        bisect can search it) through a memory map. """
+
+    def __init__(self, path, width):
+
+        self.path = path
+        self.width = width
+        self.size = os.path.getsize(path)//width
+        self.file = open(path, "rb")
+        self.map = None
+        if self.size > 0:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+
+        return self.size
+
+    def __getitem__(self, i):
+
+        return self.map[i*self.width:(i+1)*self.width]
+
+    def __contains__(self, key):
+
+        i = bisect.bisect_left(self, key)
+        return i < self.size and self[i] == key
+
+    def __iter__(self):
+
+        for i in range(self.size):
+            yield self[i]
+
+    def close(self):
+
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+        os.remove(self.path)
+
+class Deduplicator(object):
+
+    """ Tells if a member has already been seen. key is "inchikey" (members
+        are inchis or inchikeys) or "hash" (64-bit hash of any string, e.g.
+        smiles). If memory (bytes) is given, the in-memory keys are written
+        to a sorted run file in directory (default: the temporary
+        directory) whenever they take more than memory, and the last two
+        runs are merged while the older one is not larger. Use close() (or
+        a with statement) to delete the run files. """
+
+    def __init__(self, key="inchikey", memory=None, directory=None):
+
+        if key not in KEY_WIDTHS:
+            raise ValueError(f"unknown key {key!r}, expected one of {tuple(KEY_WIDTHS)}")
+        self.key = inchikey if key == "inchikey" else hash64
+        self.width = KEY_WIDTHS[key]
+        self.memory = memory
+        self.directory = directory
+        self.keys = set()  # keys not written to the run file yet
+        self.runs = []  # RunFiles of the spilled keys, the largest first
+        self.spills = 0  # number of times keys were written to disk
+        # approximate size of one key in the set
+        self.key_size = sys.getsizeof(bytes(self.width))
+
+    def add(self, member):
+
+        # Add a member, returning True if it was not seen before
+        key = self.key(member)
+        if key in self.keys or any(key in run for run in self.runs):
+            return False
+        self.keys.add(key)
+        if self.memory is not None and self.size() > self.memory:
+            self.spill()
+        return True
+
+    def size(self):
+
+        # Approximate memory taken by the in-memory keys (bytes)
+        return sys.getsizeof(self.keys)+len(self.keys)*self.key_size
+
+    def write_run(self, keys):
+
+        # New run file of sorted keys
+        handle, path = tempfile.mkstemp(suffix=".run", dir=self.directory)
+        with os.fdopen(handle, "wb") as file:
+            for key in keys:
+                file.write(key)
+        return RunFile(path, self.width)
+
+    def spill(self):
+
+        # Write the in-memory keys to a new run file, then merge the last
+        # two runs while the older one is not larger (as the digits of a
+        # binary counter), so there are at most log2(spills)+1 runs
+        self.runs.append(self.write_run(sorted(self.keys)))
+        self.keys = set()
+        self.spills += 1
+        while len(self.runs) > 1 and len(self.runs[-2]) <= len(self.runs[-1]):
+            newer = self.runs.pop()
+            older = self.runs.pop()
+            self.runs.append(self.write_run(heapq.merge(older, newer)))
+            older.close()
+            newer.close()
+
+    def __len__(self):
+
+        # Number of different members added
+        return len(self.keys)+sum(len(run) for run in self.runs)
+
+    def close(self):
+
+        for run in self.runs:
+            run.close()
+        self.runs = []
+        self.keys = set()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc):
+
+        self.close()
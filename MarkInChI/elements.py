@@ -0,0 +1,55 @@
+from rdkit import Chem
+
+# This module contains the properties of the elements used for every atom
+# of every member (masses, valences...). They are read once, when the
+# module is imported, and kept in lists indexed by atomic number (symbols
+# are converted with ATOMIC_NUMBERS), so the labelling and the
+# sanitisation don't ask the periodic table of RDKit atom by atom.
+
+table = Chem.GetPeriodicTable()
+NUMBER_OF_ELEMENTS = 119  # atomic numbers 0 (dummy atom) to 118
+
+def inchi_mass(atomic_number):
+
+    """ This function returns the mass the InChI algorithm gives to the
+        atoms of an element without isotopic label: the isotopic layer of
+        an inchi is the shift of an isotope from it (e.g. "/i1+1" is 20F).
+        It is the average atomic mass rounded (RDKit and InChI don't round
+        all of them the same), so it is asked to InChI once. The most
+        common isotope mass of RDKit truncated is not always the same
+        (18.998 gives 18 for F, which MarkMol.label used to patch by
+        hand). """
+
+    if atomic_number == 0:
+        return 0
+    isotope = table.GetMostCommonIsotope(atomic_number)
+    mol = Chem.RWMol()
+    atom = Chem.Atom(atomic_number)
+    atom.SetIsotope(isotope)
+    atom.SetNoImplicit(True)
+    mol.AddAtom(atom)
+    inchi = Chem.MolToInchi(mol.GetMol())
+    if inchi.find("/i") == -1:
+        return isotope
+    shift = inchi.split("/i")[1].split("/")[0].lstrip("0123456789")
+    return isotope-int(shift)
+
+# {symbol: atomic number}
+ATOMIC_NUMBERS = {table.GetElementSymbol(number): number
+                  for number in range(NUMBER_OF_ELEMENTS)}
+# most common isotope mass (truncated)
+MASSES = [int(table.GetMostCommonIsotopeMass(number))
+          for number in range(NUMBER_OF_ELEMENTS)]
+# mass of an atom without isotopic label in an inchi (see inchi_mass)
+INCHI_MASSES = [inchi_mass(number) for number in range(NUMBER_OF_ELEMENTS)]
+OUTER_ELECTRONS = [table.GetNOuterElecs(number)
+                   for number in range(NUMBER_OF_ELEMENTS)]
+# allowed valences (e.g. (2, 4, 6) for S, (-1,) if any)
+VALENCE_LISTS = [tuple(table.GetValenceList(number))
+                 for number in range(NUMBER_OF_ELEMENTS)]
+
+def mass(symbol):
+
+    # Truncated most common isotope mass of an element given its symbol
+    # (as the labels of Label are built)
+    return MASSES[ATOMIC_NUMBERS[symbol]]
@@ -0,0 +1,109 @@
+from instrumentation import get_logger
+
+logger = get_logger("expansion")
+
+# This module contains the iterative expansion of the combinations of
+# substitutions of a markinchi. It doesn't recurse, so the number of blocks
+# is not limited by the recursion limit of python, and all of its state is
+# kept in the Expansion object, so it can be paused, saved and resumed.
+
+class Expansion(object):
+
+    """ Odometer over the blocks of a MarkInChI (the last block changing
+        fastest). Iterating over it yields the finalised molecule of every
+        combination (see MarkInChI.finalise), duplicates included. State:
+        - path: indices of the substitutions being expanded in the blocks
+          before the current one
+        - index: next substitution to try in the current block
+        - used_substituent: key of the attachment used by the previous
+          block, substitutions with the same key are skipped. As in the
+          recursive version of the algorithm it is reset once a
+          substitution has been fully expanded.
+        prefix holds the indices of the substitutions used for the first
+        blocks (see MarkInChI.run_parallel). Iteration can be stopped at
+        any time; checkpoint() returns a dict (of strings, numbers and
+        lists) to continue later, e.g. in another process, with
+        MarkInChI.run(checkpoint=...). """
+
+    def __init__(self, inchi_obj, prefix=(), checkpoint=None):
+
+        self.inchi_obj = inchi_obj
+        self.prefix = tuple(prefix)
+        self.path = []
+        self.index = 0
+        self.used_substituent = None
+        self.count = 0  # number of combinations produced
+        if checkpoint is not None:
+            if checkpoint["markinchi"] != inchi_obj.markinchi:
+                raise ValueError("checkpoint of another markinchi")
+            self.prefix = tuple(checkpoint["prefix"])
+            self.path = list(checkpoint["path"])
+            self.index = checkpoint["index"]
+            self.used_substituent = checkpoint["used_substituent"]
+            self.count = checkpoint["count"]
+
+    def checkpoint(self):
+
+        # State of the expansion after the last combination produced
+        return {"markinchi": self.inchi_obj.markinchi,
+                "prefix": list(self.prefix), "path": list(self.path),
+                "index": self.index,
+                "used_substituent": self.used_substituent,
+                "count": self.count}
+
+    def __iter__(self):
+
+        inchi_obj = self.inchi_obj
+        grouplists = inchi_obj.grouplists
+        if len(grouplists) == 0:
+            return
+        # molecules after the substitutions of path (the core first)
+        mols = [inchi_obj.core_mol]
+        for level, index in enumerate(self.path):
+            mols.append(inchi_obj.substitute(mols[-1], grouplists[level][index]))
+        while True:
+            level = len(self.path)
+            grouplist = grouplists[level]
+            last = level == len(grouplists)-1  # no more blocks after it
+            if self.index == 0:
+                logger.debug("block: %s", inchi_obj.inchiplus[level])
+            if self.index >= len(grouplist):
+                # all the substitutions of the block done: go back to the
+                # next substitution of the previous block
+                if level == 0:
+                    return
+                self.index = self.path.pop()+1
+                mols.pop()
+                self.used_substituent = None
+                continue
+            substitution = grouplist[self.index]
+            if substitution.key == self.used_substituent:
+                logger.debug("skipped %s (same attachment as %s)",
+                             substitution, self.used_substituent)
+                self.index += 1
+                continue
+            if level == 0 and self.index in inchi_obj.pruned:
+                # symmetric to an earlier substitution (see symmetric)
+                self.index += 1
+                continue
+            if level < len(self.prefix) and self.index != self.prefix[level]:
+                # expanded by another worker of the parallel mode: only
+                # update used_substituent as the expansion of the
+                # substitution would do
+                if not last:
+                    self.used_substituent = None
+                self.index += 1
+                continue
+            new_mol = inchi_obj.substitute(mols[-1], substitution)
+            if last:  # if finished substitutions
+                self.index += 1
+                self.count += 1
+                # produce inchi (or the output format)
+                yield inchi_obj.finalise(new_mol)
+            else:
+                # There is still more substitutions then continue
+                # with current mol and next block
+                self.used_substituent = substitution.used_key
+                self.path.append(self.index)
+                mols.append(new_mol)
+                self.index = 0
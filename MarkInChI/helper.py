@@ -1,4 +1,5 @@
 from rdkit import Chem
+from layers import InChILayers, parse_formula
 
 class helper(object):
 
@@ -7,32 +8,17 @@ class helper(object):
     #Get number of Zz atoms
     no = 0
     start_zz = 0
-    index = inchi.find("Te")+2
-    if index != 1:
-        char = inchi[index]
-        no = 1
-        no_atoms = ""
-        while char != "/":
-            no_atoms += str(char)
-            index += 1
-            char = inchi[index]
-        if no_atoms != "":  # more than one Zz atom in the formula
-            no = int(no_atoms)
+    layers = InChILayers(inchi)
+    for element, count in parse_formula(layers.formula):
+        if element == "Te":
+            no += count
+    if no > 0:
         # Get the rank of each Zz atom
-        line = inchi.split("/")[2][1:]  # canonical numbering string
-        list_of_no = []
-        for n in line.split("-"):
-            # produce an ordered list canonical numbers
-            if "(" or ")" in n:
-                if "," in n:
-                    n_list = n.replace(",", "-").replace("(", "-").replace(")", "-").split("-")
-                    list_of_no += n_list
-                else:
-                    n_list = n.replace("(", "-").replace(")", "-").split("-")
-                    list_of_no += n_list
-            else:
-                list_of_no.append(n)
-        list_int = set(map(int, list_of_no))  # convert list of numbers to int
+        line = layers.layer("c", "")  # canonical numbering string
+        for char in "(),;*":
+            line = line.replace(char, "-")
+        # produce an ordered list canonical numbers
+        list_int = set(int(n) for n in line.split("-") if n.isdigit())
         start_zz = max(list_int)-no+1  # lowest canonical number of a Zz atom
 
     return no, start_zz
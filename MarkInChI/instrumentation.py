@@ -0,0 +1,34 @@
+import logging
+
+# This module contains the logging helpers used instead of printing. All the
+# loggers are children of the "markinchi" logger, so the messages of the
+# whole package can be shown with e.g.
+#     logging.basicConfig()
+#     logging.getLogger("markinchi").setLevel(logging.DEBUG)
+# Nothing is shown below the WARNING level unless the caller configures
+# logging.
+
+def get_logger(name):
+
+    # Logger of a module of the package
+    if name == "markinchi":
+        return logging.getLogger(name)
+    return logging.getLogger("markinchi." + name)
+
+class lazy(object):
+
+    """ Message argument that is only computed when the message is
+        emitted, e.g.
+            logger.debug("smiles: %s", lazy(Chem.MolToSmiles, mol))
+        only writes the smiles if the debug level is enabled. """
+
+    __slots__ = ("function", "args")
+
+    def __init__(self, function, *args):
+
+        self.function = function
+        self.args = args
+
+    def __str__(self):
+
+        return str(self.function(*self.args))
@@ -1,94 +1,264 @@
 import sys
+import bisect
 
 from rdkit import Chem
-import copy
+from rdkit.Chem import rdqueries
 import numpy
 from helper import helper
+from layers import InChILayers, atom_table
+from cache import LRUCache
+from elements import ATOMIC_NUMBERS, MASSES, INCHI_MASSES, OUTER_ELECTRONS, VALENCE_LISTS, mass
+from instrumentation import get_logger
+
+logger = get_logger("label")
+
+# Prepared substituent fragments shared by all the Label instances of the
+# process {"InChI=1B/..." or smiles: (mol, sub_mol, sub_label)}
+fragment_cache = LRUCache(maxsize=1024)
+
+def bracket_query():
+
+    # One atom pattern of the atoms written in brackets in a smiles
+    # whatever their hydrogens: not in the organic subset (B, C, N, O, P,
+    # S, F, Cl, Br, I), charged, labelled (isotope or atom map number),
+    # radical or chiral
+    query = rdqueries.AtomNumEqualsQueryAtom(5, negate=True)
+    for atomic_number in (6, 7, 8, 9, 15, 16, 17, 35, 53):
+        query.ExpandQuery(rdqueries.AtomNumEqualsQueryAtom(atomic_number, negate=True),
+                          Chem.CompositeQueryType.COMPOSITE_AND)
+    for other in (rdqueries.FormalChargeEqualsQueryAtom(0, negate=True),
+                  rdqueries.IsotopeEqualsQueryAtom(0, negate=True),
+                  rdqueries.HasPropQueryAtom("molAtomMapNumber"),
+                  rdqueries.NumRadicalElectronsEqualsQueryAtom(0, negate=True),
+                  rdqueries.HasChiralTagQueryAtom()):
+        query.ExpandQuery(other, Chem.CompositeQueryType.COMPOSITE_OR)
+    pattern = Chem.RWMol()
+    pattern.AddAtom(query)
+    return pattern.GetMol()
+
+# Searched by Label.sanitize and Label.sanitize_charges as substructures,
+# which is much faster than checking every atom in python
+BRACKET = bracket_query()
+NOT_CARBON = Chem.MolFromSmarts("[!#6]")
+# outer electrons of every element (see sanitize_charges)
+OUTER_ELECTRONS_ARRAY = numpy.array(OUTER_ELECTRONS)
+
+def matching_atoms(mol, pattern):
+
+    # Indices of the atoms of mol matching a one atom pattern
+    matches = mol.GetSubstructMatches(pattern, uniquify=False,
+                                      maxMatches=mol.GetNumAtoms()+1)
+    return [match[0] for match in matches]
+
+def labelled_query():
+
+    # One atom pattern of the atoms AtomLabels keeps: labelled (isotope
+    # or atom map number) or Te
+    query = rdqueries.IsotopeEqualsQueryAtom(0, negate=True)
+    for other in (rdqueries.HasPropQueryAtom("molAtomMapNumber"),
+                  rdqueries.AtomNumEqualsQueryAtom(52)):
+        query.ExpandQuery(other, Chem.CompositeQueryType.COMPOSITE_OR)
+    pattern = Chem.RWMol()
+    pattern.AddAtom(query)
+    return pattern.GetMol()
+
+LABELLED = labelled_query()
+
+def clear_bond_stereo(mol):
+
+    # Write the stereochemistry of the double bonds of mol (in place) as
+    # the directions of their neighbouring bonds, as a smiles read without
+    # sanitisation has them: the double bonds have no stereo, so the inchis
+    # of the members have no /b layer, but a smiles written from them keeps
+    # the directions ("F/C=C/C")
+    bonds = [bond for bond in mol.GetBonds()
+             if bond.GetStereo() > Chem.BondStereo.STEREOANY]
+    if len(bonds) > 0:
+        Chem.SetDoubleBondNeighborDirections(mol)
+        for bond in bonds:
+            bond.SetStereo(Chem.BondStereo.STEREONONE)
+        # perceived again from the directions when a smiles is written
+        mol.ClearProp("_StereochemDone")
+
+class AtomLabels(object):
+
+    """ Indices of the labelled atoms of a molecule {isotope: [atom
+        indices]} and {atom map number: [atom indices]} and of its Te
+        atoms, so the atoms with a label (or the
+        Te to delete) are found without looking at every atom of the
+        molecule. They are only built from the atoms (see atom_labels)
+        for the core and the fragments: the edits of Label and
+        MarkInChI.replacement work out the indices of the molecule they
+        build (RemoveAtom, AddAtom, CombineMols...) from those of the
+        molecule they start from. Indices of atoms whose label changed
+        since (e.g. reset by sanitize) are skipped by find. The indices of
+        a molecule are shared with it and are not modified: edits work on
+        a copy. """
+
+    def __init__(self, mol=None):
+
+        self.isotopes = {}  # {isotope: atom indices in order}
+        self.maps = {}  # {atom map number: atom indices in order}
+        self.te = []  # indices of the Te atoms in order
+        if mol is not None:
+            for index in matching_atoms(mol, LABELLED):
+                self.set(index, mol.GetAtomWithIdx(index))
+
+    def copy(self):
+
+        labels = AtomLabels()
+        labels.isotopes = {isotope: list(indices)
+                           for isotope, indices in self.isotopes.items()}
+        labels.maps = {number: list(indices)
+                       for number, indices in self.maps.items()}
+        labels.te = list(self.te)
+        return labels
+
+    def set(self, index, atom):
+
+        # Record the labels of the atom index (after it is added or its
+        # isotope, atom map number or element changed)
+        for labels, label in ((self.isotopes, atom.GetIsotope()),
+                              (self.maps, atom.GetAtomMapNum())):
+            if label != 0:
+                indices = labels.setdefault(label, [])
+                if index not in indices:
+                    bisect.insort(indices, index)
+        if atom.GetAtomicNum() == 52 and index not in self.te:
+            bisect.insort(self.te, index)
+
+    def find(self, mol, isotope):
+
+        # Indices of the atoms of mol labelled isotope, in order
+        return [index for index in self.isotopes.get(isotope, ())
+                if mol.GetAtomWithIdx(index).GetIsotope() == isotope]
+
+    def find_map(self, mol, number):
+
+        # Indices of the atoms of mol with the atom map number, in order
+        return [index for index in self.maps.get(number, ())
+                if mol.GetAtomWithIdx(index).GetAtomMapNum() == number]
+
+    def lowest_te(self, mol, maps=False, skipped=()):
+
+        # Index of the Te atom of mol with the lowest label (isotope, or
+        # atom map number if maps is True), the first one if several have
+        # it, None if there is no Te (the indices in skipped are not Te)
+        lowest = None
+        for index in self.te:
+            atom = mol.GetAtomWithIdx(index)
+            if atom.GetAtomicNum() != 52 or index in skipped:
+                continue
+            label = atom.GetAtomMapNum() if maps else atom.GetIsotope()
+            if lowest is None or label < lowest[0]:
+                lowest = (label, index)
+        return None if lowest is None else lowest[1]
+
+    def remove(self, index):
+
+        # Forget the atom index and shift the atoms after it (RemoveAtom)
+        def shifted(indices):
+            return [i-1 if i > index else i for i in indices if i != index]
+        self.isotopes = {isotope: shifted(indices)
+                         for isotope, indices in self.isotopes.items()}
+        self.maps = {number: shifted(indices)
+                     for number, indices in self.maps.items()}
+        self.te = shifted(self.te)
+
+    def combine(self, other, offset):
+
+        # Indices of Chem.CombineMols(mol, other mol), the atoms of the
+        # other molecule coming after the offset atoms of this one
+        labels = self.copy()
+        for isotope, indices in other.isotopes.items():
+            labels.isotopes.setdefault(isotope, []).extend(
+                index+offset for index in indices)
+        for number, indices in other.maps.items():
+            labels.maps.setdefault(number, []).extend(
+                index+offset for index in indices)
+        labels.te.extend(index+offset for index in other.te)
+        return labels
+
+def atom_labels(mol):
+
+    # AtomLabels of mol, built from its atoms if it was not given any
+    labels = getattr(mol, "labels", None)
+    if labels is None:
+        labels = AtomLabels(mol)
+        mol.labels = labels
+    return labels
 
 # This module will be used to label atoms as isotopes.
 # This will also be able to find the position of an atom given its label
 # This will also contain other helpful functions
 
+# Labellings of the atoms of the core that are replaced: isotopes written
+# in the inchi (see label_inchi) or atom map numbers (see label_mol)
+LABELLINGS = ("isotope", "map")
+# Shift of the label of the first Te atom (see label_inchi)
+TE_SHIFT = 139
+
+def isotopes_fit(atoms, ranks, elements):
+
+    """ This function returns True if the atoms of the ranks (ints) of a
+        core, whose symbols are atoms (see layers.atom_table, Zz for the Te
+        atoms), can be labelled with isotopes by label_inchi: every label
+        (mass of the atom shifted by rank+10) must be below the labels of
+        the atoms bonded by combine_fragment (mass+30 or mass+35, for the
+        lightest of the elements of the core and of the substituents) and
+        of the Te atoms, or atoms of the core are taken for them. If not,
+        the core has to be labelled by label_mol. """
+
+    if len(ranks) == 0:
+        return True
+    te = ATOMIC_NUMBERS["Te"]
+    limit = INCHI_MASSES[te]+TE_SHIFT
+    for element in elements:
+        if element not in ("H", "Zz"):
+            limit = min(limit, mass(element)+30)
+    highest = max(INCHI_MASSES[ATOMIC_NUMBERS.get(atoms[rank-1], te)]+rank+10
+                  for rank in ranks)
+    return highest < limit
+
+def isotope_masses(inchi):
+
+    # Mass numbers of the atoms of an inchi given by its isotopic layer
+    # {rank: mass}, e.g. 13 for "/i4+1" and 11 for "/i4-1" on a carbon of
+    # rank 4 (hydrogen isotopes such as "5D" are not atoms of the ranks)
+    layers = InChILayers(inchi)
+    atoms = atom_table(layers.formula)
+    masses = {}
+    for rank, shift in layers.isotopes().items():
+        end = 1
+        while end < len(shift) and shift[end].isdigit():
+            end += 1
+        if shift[:1] in ("+", "-") and end > 1:
+            masses[rank] = (INCHI_MASSES[ATOMIC_NUMBERS[atoms[rank-1]]]
+                            + int(shift[:end]))
+    return masses
+
 class Label(object):
 
-    def __init__(self):
+    def __init__(self, labelling="isotope"):
+        if labelling not in LABELLINGS:
+            raise ValueError(f"unknown labelling {labelling!r}, expected one of {LABELLINGS}")
         self.helper = helper()
+        self.labelling = labelling
+
     def label(self, inchi, rank, lab):
         # rank, lab are strings
-        # Label the atom
-        if inchi.find("/i") == -1:  # no isotopic layer
-            if inchi.find("/f") == -1:  # no fixed layer
-                if inchi.find("/r") == -1:  # no organometallic layer
-                    # just add label to the end of inchi
-                    inchi += "/i"+rank.split("H")[0]+"+"+lab
-                else:
-                    # no /i, no /f but contains /r
-                    isotope = "/i"+rank.split("H")[0]+"+"+lab
-                    index = inchi.find("/r")
-                    inchi = inchi[:index]+isotope+inchi[index:]
-            else:
-                # no /i but there is /f or /r or both
-                isotope = "/i"+rank.split("H")[0]+"+"+lab
-                index = inchi.find("/f")
-                inchi = inchi[:index]+isotope+inchi[index:]
-        else:
-            # there is isotopic layer in inchi
-            index = inchi.find("/i")
-            indexf = inchi[index+2:].find("/")
-            sub = ""
-            if indexf == -1:
-                # isotopic layer is last layer
-                sub = ","+inchi[index+2:]
-            else:
-                # isotopic layer not last layer
-                sub = ","+inchi[index+2:index+2+indexf]
-            for i in range(0, len(sub)):
-                # scan the isotopic layer to add the label at the right atom
-                if sub[i] == ",":
-                    num = sub[i:].split(",")[1].split("+")[0]
-                    if num == rank:  # if atom is labelled
-                        iso_num = int(sub[i:].split(",")[1].split("+")[0])
-                        index2 = sub[i+1:].find(",")
-                        if index2 != -1:
-                            isotope = rank.split("H")[0]+"+"+lab
-                            inchi = inchi[:index+2+i]+isotope+inchi[index2+i:]
-                            break
-                        else:
-                            isotope = rank.split("H")[0]+"+"+lab
-                            inchi = inchi[:index+2+i]+isotope+inchi[index+1+len(sub):]
-                            break
-                    else:  # if atom is not labelled
-                        if int(num) > int(rank.split("H")[0]):
-                            isotope = rank.split("H")[0]+"+"+lab+","
-                            inchi = inchi[:index+2+i]+isotope+inchi[index+2+i:]
-                            break
-            else:
-                # if all numbers are lower we just add to the end of
-                # the isotopic layer
-                isotope = ","+rank.split("H")[0]+"+"+lab
-                sub += isotope
-                if indexf == -1:
-                    # case: no other layer after isotopic layer
-                    inchi = inchi[:index+2]+sub[1:]
-                else:
-                    # case: there is a layer after isotopic layer
-                    inchi = inchi[:index+2]+sub[1:]+inchi[index+2+indexf:]
-        return inchi
-
-    def label_inchi(self, inchi, inchiplus):
+        # Label the atom (replacing its label if it already has one)
+        layers = InChILayers(inchi)
+        isotopes = layers.isotopes()
+        isotopes[int(rank.split("H")[0])] = "+"+lab
+        layers.set_isotopes(isotopes)
+        return str(layers)
 
-        """ This function is used to obtain canonical labelling for the
-            atoms that will be replaced as the inchi canonical labelling
-            is going to change after every substitution. Each atom will
-            be labelled by a label where:
-            label = rank + 10 + atomic mass of the atom
-            10 is added to not get an isotope that exists for low ranks and
-            using adding rank will make it canonical.
-            This function returns the labelled inchi and a dictionary ranks
-            so labels can be obtained easily. """
+    def replaced_ranks(self, inchiplus):
 
-        ranks = {}  # dict {rank:label}
-        new_inchi = inchi
+        # This function returns the ranks (strings) of the atoms replaced
+        # by the blocks, in order and without repetitions
+        ranks = []
         for sub in inchiplus:
             molecule = sub.split("!")[0].split("/")[0]
             if molecule.find("-") != -1:
@@ -98,54 +268,124 @@ class Label(object):
                     for mini_sub in molecule.split(","):
                         # get ranks of atoms to be labelled
                         num = mini_sub.split("-")[0].split("H")[0]
-                        table = Chem.GetPeriodicTable()
-                        atom = self.find_atom(num, inchi.split("/")[1])
-                        atomic_mass = int(table.GetMostCommonIsotopeMass(atom))
-                        if num not in ranks.keys():
-                            # add rank to dictionary ranks if doesn't exist
-                            ranks[num] = int(num)+10+atomic_mass
-                            new_inchi = self.label(new_inchi, num, str(int(num)+10))
+                        if num not in ranks:
+                            ranks.append(num)
                         else:
                             #raise RuntimeError("Same atom replaced more than once")
-                            print("Overlap of possible substitutions - check that result is as expected.")
+                            logger.warning("Overlap of possible substitutions - check that result is as expected.")
                 else:
                     # only replacements with no variable attachments
                     num = molecule.split("-")[0].split("H")[0]
-                    print(f"num: {num}")
-                    table = Chem.GetPeriodicTable()
-                    atom = self.find_atom(num, inchi.split("/")[1])
-                    atomic_mass = int(table.GetMostCommonIsotopeMass(atom))
-                    if num not in ranks.keys():
-                        ranks[num] = int(num)+10+atomic_mass
-                        new_inchi = self.label(new_inchi, num, str(int(num)+10))
-                        print(f"new_inchi: {new_inchi}")
+                    if num not in ranks:
+                        ranks.append(num)
                     else:
                         raise RuntimeError("Same atom replaced more than once")
+        return ranks
+
+    def label_inchi(self, inchi, inchiplus):
+
+        """ This function is used to obtain canonical labelling for the
+            atoms that will be replaced as the inchi canonical labelling
+            is going to change after every substitution. Each atom will
+            be labelled by a label where:
+            label = rank + 10 + atomic mass of the atom
+            10 is added to not get an isotope that exists for low ranks and
+            using adding rank will make it canonical.
+            This function returns the labelled inchi and a dictionary ranks
+            so labels can be obtained easily. All the labels are written
+            to the isotopic layer at once. Only low ranks can be labelled
+            this way (see isotopes_fit and label_mol). """
+
+        ranks = {}  # dict {rank:label}
+        layers = InChILayers(inchi)
+        isotopes = layers.isotopes()  # {rank: label} of the isotopic layer
+        atoms = atom_table(layers.formula)  # symbol of every rank
+        for num in self.replaced_ranks(inchiplus):
+            atom = atoms[int(num)-1]
+            atomic_mass = INCHI_MASSES[ATOMIC_NUMBERS[atom]]
+            ranks[num] = int(num)+10+atomic_mass
+            isotopes[int(num)] = "+"+str(int(num)+10)
+            logger.debug("label of %s: %s", num, isotopes[int(num)])
         # Now we label Te atoms:
-        if new_inchi.find("Te") != -1:
-            no, start_zz = self.helper.zz_no(new_inchi)
+        if inchi.find("Te") != -1:
+            no, start_zz = self.helper.zz_no(inchi)
             for i in range(0, no):
-                new_inchi = self.label(new_inchi, str(i+start_zz),
-                                       str(128+10+i+1))
-        return new_inchi, ranks
+                isotopes[i+start_zz] = "+"+str(TE_SHIFT+i)
+        layers.set_isotopes(isotopes)
+        return str(layers), ranks
+
+    def label_mol(self, inchi, inchiplus):
+
+        """ This function labels the atoms that will be replaced as
+            label_inchi does, but with atom map numbers set on the molecule
+            of the inchi (the atom of rank r is its atom r-1) instead of
+            isotopes written in the inchi, so there is no limit on the
+            ranks. The label of an atom is its rank, and the Te atoms are
+            labelled by their ranks as well, which keeps their order. This
+            function returns the labelled molecule and a dictionary ranks
+            {rank: label}. """
+
+        mol = Chem.rdinchi.InchiToMol(inchi)[0]
+        ranks = {}  # dict {rank:label}
+        for num in self.replaced_ranks(inchiplus):
+            ranks[num] = int(num)
+            mol.GetAtomWithIdx(int(num)-1).SetAtomMapNum(int(num))
+        for index in range(mol.GetNumAtoms()):
+            atom = mol.GetAtomWithIdx(index)
+            if atom.GetAtomicNum() == 52:
+                atom.SetAtomMapNum(index+1)
+        return mol, ranks
+
+    def core_label(self, atom):
+
+        # Label given to an atom of the core by label_inchi or label_mol
+        if self.labelling == "map":
+            return atom.GetAtomMapNum()
+        return atom.GetIsotope()
+
+    def find_label(self, mol, num, labels=None):
+
+        # Indices of the atoms of mol with the label num of label_inchi or
+        # label_mol, in order (labels: AtomLabels of mol if it has none)
+        if labels is None:
+            labels = atom_labels(mol)
+        if self.labelling == "map":
+            return labels.find_map(mol, num)
+        return labels.find(mol, num)
+
+    def unlabel(self, atom, isotope=0):
+
+        # Remove the label of label_inchi or label_mol from an atom, giving
+        # it isotope (with label_mol the atom keeps its own isotope)
+        if self.labelling == "map":
+            atom.SetAtomMapNum(0)
+        else:
+            atom.SetIsotope(isotope)
+
+    def unlabel_bonded(self, atom, isotope=0):
+
+        # Unlabel (see unlabel) an atom of the core a substituent is being
+        # bonded to in place of one of its hydrogens. An atom left with an
+        # isotope is kept in brackets by sanitize, with its hydrogens, so
+        # the hydrogen replaced is removed here
+        self.unlabel(atom, isotope)
+        if atom.GetIsotope() != 0 and atom.GetNumExplicitHs() > 0:
+            atom.SetNumExplicitHs(atom.GetNumExplicitHs()-1)
 
     def delete_zz(self, mol):
 
         # This function delete the instance of Zz with the lowest rank
         # and returns the new mol
-        index = 0
-        min_rank = 10000
-        new_mol = copy.deepcopy(self.sanitize(mol))
-        rwmol = Chem.RWMol(new_mol)
-        for atom in rwmol.GetAtoms():
-            cn1 = atom.GetIsotope() < min_rank
-            cn2 = atom.GetSymbol() == "Te"
-            if  cn1 and cn2:
-                min_rank = atom.GetIsotope()
-                index = atom.GetIdx()
+        rwmol = self.sanitize(mol)  # a new RWMol
+        labels = atom_labels(mol).copy()
+        index = labels.lowest_te(rwmol, self.labelling == "map")
+        if index is None:
+            index = 0
         rwmol.RemoveAtom(index)
-        new_mol = rwmol.GetMol()
-        return copy.deepcopy(self.sanitize(new_mol))
+        labels.remove(index)
+        new_mol = self.sanitize(rwmol, in_place=True)
+        new_mol.labels = labels
+        return new_mol
 
     def get_index(self, mol, label):
 
@@ -153,39 +393,62 @@ class Label(object):
         # lowest rank and deletes Te
         index = 0
         index1 = 1
-        new_mol = copy.deepcopy(self.sanitize(mol))
-        min_rank = 100000000
         rwmol = Chem.RWMol(mol)
-        for atom in rwmol.GetAtoms():
-            if atom.GetSymbol() == "Te" and atom.GetIsotope() < min_rank:
-                min_rank = atom.GetIsotope()
-                index1 = atom.GetIdx()
-                num = rwmol.GetNumAtoms()-1
-                for i in reversed(range(0, num)):
-                    if mol.GetBondBetweenAtoms(i, index1) != None:
-                        index = i
-        pre_label = rwmol.GetAtoms()[index].GetIsotope()
-        symbol = rwmol.GetAtoms()[index].GetSymbol()
+        labels = atom_labels(mol).copy()
+        te = labels.lowest_te(mol, self.labelling == "map")
+        if te is not None:
+            index1 = te
+            # first neighbour (the last atom is not looked at)
+            last = rwmol.GetNumAtoms()-1
+            neighbours = [atom.GetIdx() for atom
+                          in mol.GetAtomWithIdx(te).GetNeighbors()
+                          if atom.GetIdx() < last]
+            if len(neighbours) > 0:
+                index = min(neighbours)
+        atom = rwmol.GetAtomWithIdx(index)
+        pre_label = atom.GetIsotope()
+        symbol = atom.GetSymbol()
         # label connected atom by prelabel+label
         post_label = 0
         if pre_label == 0:
-            table = Chem.GetPeriodicTable()
-            atomic_mass = int(table.GetMostCommonIsotopeMass(symbol))
-            post_label = atomic_mass+label
+            post_label = mass(symbol)+label
         else:
             post_label = pre_label+label
-        rwmol.GetAtoms()[index].SetIsotope(post_label)
+        atom.SetIsotope(post_label)
+        labels.set(index, atom)
         rwmol.RemoveAtom(index1)
+        labels.remove(index1)
         new_mol = rwmol.GetMol()
-        new_index = 0
-        for atom in new_mol.GetAtoms():
-            if atom.GetSymbol == symbol and atom.GetIsotope() == post_label:
-                new_index = atom.GetIdx()
-        return copy.deepcopy(new_mol), post_label
+        new_mol.labels = labels
+        return new_mol, post_label
 
-    def combine(self, main_mol, sub_mol, num = None):
+    def fragment(self, substituent):
+
+        """ This function returns the substituent (an inchi starting with
+            "InChI=1B/" or a smiles) as a tuple (mol, sub_mol, sub_label):
+            mol is the molecule as parsed and sub_mol is the molecule ready
+            for combine_fragment, with its attachment atom labelled by
+            sub_label. Fragments are kept in fragment_cache so every
+            substituent is only parsed once per process. The molecules are
+            shared and must not be modified. """
 
-        # label 30 for sub_mol, and label 35 for main_mol
+        fragment = fragment_cache.get(substituent)
+        if fragment is None:
+            if substituent.startswith("InChI="):
+                mol = Chem.rdinchi.InchiToMol(substituent)[0]
+            else:
+                mol = Chem.MolFromSmiles(substituent)
+            sub_mol = Chem.Mol(mol)
+            clear_bond_stereo(sub_mol)
+            sub_mol, sub_label = self.prepare_fragment(sub_mol)
+            atom_labels(sub_mol)  # built before it is shared
+            fragment = (mol, sub_mol, sub_label)
+            fragment_cache.put(substituent, fragment)
+        return fragment
+
+    def prepare_fragment(self, sub_mol):
+
+        # label 30 for the atom of sub_mol that will be attached
         sub_label = 0
         if sub_mol.GetNumAtoms() > 1:
             sub_mol, sub_label = self.get_index(sub_mol, 30)
@@ -193,144 +456,213 @@ class Label(object):
             pre_label = sub_mol.GetAtoms()[0].GetIsotope()
             post_label = 0
             if pre_label == 0:
-                table = Chem.GetPeriodicTable()
-                atom = sub_mol.GetAtoms()[0].GetSymbol()
-                atomic_mass = int(table.GetMostCommonIsotopeMass(atom))
-                post_label = atomic_mass+30
+                atom = sub_mol.GetAtoms()[0]
+                post_label = MASSES[atom.GetAtomicNum()]+30
             else:
                 post_label = pre_label+30
             sub_mol.GetAtoms()[0].SetIsotope(post_label)
             sub_label = post_label
+        return sub_mol, sub_label
+
+    def combine(self, main_mol, sub_mol, num = None):
 
+        sub_mol, sub_label = self.prepare_fragment(sub_mol)
+        return self.combine_fragment(main_mol, sub_mol, sub_label, num)
+
+    def combine_fragment(self, main_mol, sub_mol, sub_label, num = None,
+                         isotope=0):
+
+        # label 30 for sub_mol (see prepare_fragment), and label 35 for
+        # main_mol (the atom of the core labelled num gets isotope, see
+        # unlabel_bonded)
         if num != None:
             main_label = num
             new_mol = main_mol
         else:
             new_mol, main_label = self.get_index(main_mol, 35)
-        combo = Chem.CombineMols(sub_mol, new_mol)
-        edcombo = Chem.EditableMol(combo)
+        combo = Chem.RWMol(Chem.CombineMols(sub_mol, new_mol))
+        labels = atom_labels(sub_mol).combine(atom_labels(new_mol),
+                                              sub_mol.GetNumAtoms())
         single = Chem.rdchem.BondType.SINGLE
         sub_index = 0
         main_index = 0
-        back_mol = edcombo.GetMol()
-        for atom in back_mol.GetAtoms():
+        if num != None:
+            # atom of the core labelled num (see core_label)
+            main_indices = self.find_label(combo, num, labels)
+        else:
+            main_indices = labels.find(combo, main_label)
+        # atoms labelled sub_label or main_label, in order
+        indices = sorted(set(labels.find(combo, sub_label)+main_indices))
+        for index in indices:
+            atom = combo.GetAtomWithIdx(index)
             if atom.GetIsotope() == sub_label:
-                sub_index = atom.GetIdx()
+                sub_index = index
                 atom.SetIsotope(sub_label-30)
-            if atom.GetIsotope() == main_label:
-                main_index = atom.GetIdx()
-                if num == None:
-                    atom.SetIsotope(main_label-35)
-                else:
-                    atom.SetIsotope(0)
-        edcombo = Chem.EditableMol(back_mol)
-        edcombo.AddBond(sub_index, main_index, order=single)
-        final_mol = self.sanitize(edcombo.GetMol())
-        return copy.deepcopy(final_mol)
+            if num == None and atom.GetIsotope() == main_label:
+                main_index = index
+                atom.SetIsotope(main_label-35)
+            elif num != None and self.core_label(atom) == main_label:
+                main_index = index
+                self.unlabel_bonded(atom, isotope)
+            labels.set(index, atom)
+        combo.AddBond(sub_index, main_index, order=single)
+        new_mol = self.sanitize(combo, in_place=True)
+        new_mol.labels = labels
+        return new_mol
+
 
+    def attach(self, main_mol, fragments):
+
+        """ This function attaches several fragments to main_mol in one
+            edit, as combine_fragment (or delete_zz) would one after the
+            other. fragments is a list of (sub_mol, sub_label) given by
+            fragment, every one put in place of the Te with the lowest
+            label left. A sub_mol of None is a hydrogen: the Te is only
+            deleted. The atoms of the fragments are added after the atoms
+            of main_mol, the Te atoms are removed at the end and the
+            molecule is only sanitized once. """
+
+        rwmol = Chem.RWMol(main_mol)
+        labels = atom_labels(main_mol).copy()
+        single = Chem.rdchem.BondType.SINGLE
+        removed = []  # Te atoms replaced
+        for sub_mol, sub_label in fragments:
+            te = labels.lowest_te(rwmol, self.labelling == "map", removed)
+            if te is None:
+                raise RuntimeError("no Zz left to attach to")
+            removed.append(te)
+            if sub_mol is None:
+                continue
+            main_index = min(atom.GetIdx() for atom
+                             in rwmol.GetAtomWithIdx(te).GetNeighbors())
+            atom = rwmol.GetAtomWithIdx(main_index)
+            if atom.GetIsotope() == 0:
+                # the label get_index gives it, less 35
+                atom.SetIsotope(mass(atom.GetSymbol()))
+                labels.set(main_index, atom)
+            offset = rwmol.GetNumAtoms()
+            rwmol.InsertMol(sub_mol)
+            labels = labels.combine(atom_labels(sub_mol), offset)
+            sub_index = offset
+            for index in atom_labels(sub_mol).find(sub_mol, sub_label):
+                sub_index = index+offset
+                atom = rwmol.GetAtomWithIdx(sub_index)
+                atom.SetIsotope(sub_label-30)
+                labels.set(sub_index, atom)
+            rwmol.AddBond(sub_index, main_index, order=single)
+        for te in sorted(removed, reverse=True):
+            rwmol.RemoveAtom(te)
+            labels.remove(te)
+        new_mol = self.sanitize(rwmol, in_place=True)
+        new_mol.labels = labels
+        return new_mol
 
     def find_atom(self, rank, formula):
 
         # This function finds an atom given its canonical
         # position and the chemical formula from the inchi
-        atoms = []
-        dict = {}
-        atom = ""
-        no = ""
-        index = 0
-        for char in formula:
-            if char.isupper():
-                if atom not in dict.keys() and atom != "":
-                    dict[atom] = "1"
-                no = ""
-                atom = char
-            if char.islower():
-                atom += char
-            if not char.isalpha():
-                no += char
-                dict[atom] = no
-        else:
-            if no == "" and atom not in dict.keys():
-                dict[atom]="1"
-        for key in dict.keys():
-            if key != "H":
-                i = int(dict[key])
-                atoms += [key]*i
-        return atoms[int(rank)-1]
-
-    def sanitize(self, mol):
-        # there is some issues with RDKIT mol produced from inchi, while the
-        # mol produced from SMILES seem to be fine.
-        # This also sanitize isotopic labels eg. [ch2] -> c
-        new_mol = copy.deepcopy(Chem.MolFromSmiles(Chem.MolToSmiles(mol), sanitize = False))
-        for atom in new_mol.GetAtoms():
-            table = Chem.GetPeriodicTable()
-            symbol = atom.GetSymbol()
-            atomic_mass = int(table.GetMostCommonIsotopeMass(symbol))
-            if atom.GetIsotope() == atomic_mass:
-                atom.SetIsotope(0)
+        return atom_table(formula)[int(rank)-1]
+
+    def sanitize(self, mol, in_place=False):
+
+        """ This function normalises the hydrogens of mol as writing it as
+            a smiles and reading it back did (there is some issues with
+            RDKIT mol produced from inchi, while the mol produced from
+            SMILES seem to be fine) and resets the isotopic labels equal to
+            the mass of their atom (eg. [12CH2] -> C):
+            - atoms that would be written in brackets (see BRACKET) keep
+              their number of hydrogens
+            - the others get their hydrogens from their valence, except
+              when they have a number of hydrogens their valence doesn't
+              give ([CH3] with 5 bonds, [nH]...) which is kept as well
+            The atoms are edited in place, on a copy (an RWMol) unless
+            in_place is True, and only the valences are computed (no other
+            step of RDKit's sanitisation is needed). The double bonds of
+            the molecules have no stereochemistry, as a smiles read back
+            (see clear_bond_stereo, done once on the core and on the
+            fragments). Unlike the round trip the atoms keep their order. """
+
+        new_mol = mol if in_place else Chem.RWMol(mol)
+        new_mol.UpdatePropertyCache(strict=False)
+        bracket = set(matching_atoms(new_mol, BRACKET))
+        for index in range(new_mol.GetNumAtoms()):
+            atom = new_mol.GetAtomWithIdx(index)
+            if index in bracket:
+                atom.SetNumExplicitHs(atom.GetTotalNumHs())
+                atom.SetNoImplicit(True)
+                atom.SetNumRadicalElectrons(0)  # not read from a smiles
+                if atom.GetIsotope() == MASSES[atom.GetAtomicNum()]:
+                    atom.SetIsotope(0)
+            elif atom.GetNoImplicit() or atom.GetNumExplicitHs() != 0:
+                # hydrogens that may not be the ones of its valence
+                atomic_number = atom.GetAtomicNum()
+                if atom.GetIsAromatic():
+                    # only [nH] and [pH] keep their hydrogens
+                    keep = (atomic_number in (7, 15)
+                            and atom.GetNumExplicitHs() > 0)
+                else:
+                    valence = atom.GetTotalValence()
+                    keep = (atom.GetTotalNumHs() > 0
+                            and valence not in VALENCE_LISTS[atomic_number])
+                if keep:
+                    atom.SetNumExplicitHs(atom.GetTotalNumHs())
+                    atom.SetNoImplicit(True)
+                else:
+                    atom.SetNoImplicit(False)
+                    atom.SetNumExplicitHs(0)
+        # hydrogens of the atoms that get them from their valence
+        new_mol.UpdatePropertyCache(strict=False)
         return new_mol
 
     def sanitize_charges(self, mol):
 
-
-        """
-        list_of_indices = []
-        item = "["
-        for index, elem in enumerate(list(smiles)):
-            if elem == item:
-                list_of_indices.append(item)
-        i = 0
-        """
+        """ This function gives the atoms of mol (but C) the charge left
+            by their valence: the parity of the outer electrons not used
+            by bonds or hydrogens, with their sign (e.g. +1 for N with 4
+            bonds, -1 for O with 1 bond and no H). The atoms are read once
+            into arrays, the charges computed with array operations and
+            only the atoms whose charge changes are written back. mol is
+            modified in place and returned. """
 
         mol.UpdatePropertyCache(strict=False)
-        table = Chem.GetPeriodicTable()
-        for atom in mol.GetAtoms():
-            atomic_number = atom.GetAtomicNum()
-            valence = atom.GetTotalValence()
-            default_valence = table.GetDefaultValence(atomic_number)
-            electrons = table.GetNOuterElecs(atomic_number)
-            #if valence != default_valence:
-                #print(f"Warning: atom {atom.GetSymbol} not in default valence")
-            num = (electrons-valence)
-            charge = int((num%2)*numpy.sign(num))
-            if atom.GetSymbol() != "C":
-                atom.SetFormalCharge(charge)
-        return copy.deepcopy(mol)
+        atoms = [mol.GetAtomWithIdx(index)
+                 for index in matching_atoms(mol, NOT_CARBON)]
+        if len(atoms) == 0:
+            return mol
+        numbers = numpy.array([atom.GetAtomicNum() for atom in atoms])
+        valences = numpy.array([atom.GetTotalValence() for atom in atoms])
+        charges = numpy.array([atom.GetFormalCharge() for atom in atoms])
+        num = OUTER_ELECTRONS_ARRAY[numbers]-valences
+        new_charges = numpy.mod(num, 2)*numpy.sign(num)
+        for i in numpy.flatnonzero(new_charges != charges):
+            atoms[i].SetFormalCharge(int(new_charges[i]))
+        return mol
 
     def find_isotope(self, inchi, rank):
 
-        # this function finds the isotopic label of an atom in an inchi
-        result = 0
-        index = inchi.find("/i")
-        if index != -1:
-            indexf = inchi[index+2:].find("/")
-            sub = ""
-            if indexf == -1:
-                sub = inchi[index+2:]
-            else:
-                sub = inchi[index+2:indexf]
-            for part in sub.split(","):
-                rank2, iso = tuple(part.split("+"))
-                if rank2 == rank:
-                    result = iso
-        return result
+        # this function finds the mass number of an atom in an inchi (e.g.
+        # 13 for "/i7+1", 11 for "/i7-1" on a carbon of rank "7"), 0 if it
+        # has no isotopic label (see isotope_masses)
+        return isotope_masses(inchi).get(int(rank), 0)
 
     def sanitize_labels(self, ranks, inchi, mol):
 
-        """ This function resets the fake isotopic labels of the atoms
-            of an inchi to what they were before labelling"""
+        """ This function resets the fake isotopic labels (or the atom
+            map numbers, see label_mol) of the atoms of an inchi to what
+            they were before labelling"""
 
-        rwmol = Chem.RWMol(mol)
-        new_mol = copy.deepcopy(rwmol)
+        new_mol = Chem.Mol(mol)  # the labels are reset on a copy
+        layers = InChILayers(inchi)
+        masses = isotope_masses(inchi)  # isotopes of the inchi
+        atoms = atom_table(layers.formula)
+        labels = atom_labels(mol).copy()
         for rank in ranks.keys():
             num = ranks[rank]
-            atom = self.find_atom(rank, inchi.split("/")[1])
-            iso_num = self.find_isotope(inchi, rank)
-            for mol_atom in new_mol.GetAtoms():
-                cn1 = mol_atom.GetIsotope() == num
-                cn2 = mol_atom.GetSymbol() == str.upper(atom)
-                idx = mol_atom.GetIdx()
-                if cn1 and cn2:
-                    new_mol.GetAtoms()[idx].SetIsotope(int(iso_num))
-        return copy.deepcopy(new_mol.GetMol())
+            atom = atoms[int(rank)-1]
+            iso_num = masses.get(int(rank), 0)
+            for idx in self.find_label(new_mol, num, labels):
+                mol_atom = new_mol.GetAtomWithIdx(idx)
+                if mol_atom.GetSymbol() == str.upper(atom):
+                    self.unlabel(mol_atom, iso_num)
+                    labels.set(idx, mol_atom)
+        return new_mol
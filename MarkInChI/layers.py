@@ -0,0 +1,156 @@
+# This module splits an inchi into its layers so they can be read and
+# changed without looking for "/i", "/h"... in the string and splicing it.
+# It only works on strings and doesn't import RDKit.
+
+from cache import LRUCache
+
+# Atoms of the formulas already decoded {formula: tuple of symbols}
+formula_cache = LRUCache(maxsize=256)
+
+def parse_formula(formula):
+
+    """ This function returns the elements of a Hill formula with their
+        counts in order, e.g. "C10H13ClTe2" gives
+        [("C", 10), ("H", 13), ("Cl", 1), ("Te", 2)]. The formulas of the
+        components of a disconnected inchi ("C2H6.ClH") are read one after
+        the other. """
+
+    elements = []
+    index = 0
+    while index < len(formula):
+        char = formula[index]
+        if not char.isupper():
+            # component separator or multiplier ("2C2H6")
+            index += 1
+            continue
+        end = index+1
+        while end < len(formula) and formula[end].islower():
+            end += 1
+        element = formula[index:end]
+        index = end
+        while end < len(formula) and formula[end].isdigit():
+            end += 1
+        count = int(formula[index:end]) if end > index else 1
+        elements.append((element, count))
+        index = end
+    return elements
+
+def atom_table(formula):
+
+    """ This function returns the symbols of the atoms (not H) of an inchi
+        formula in the order of their canonical ranks, so the atom of rank
+        r is atom_table(formula)[r-1], e.g. "C10H13ClTe2" gives
+        ("C",)*10+("Cl", "Te", "Te"). Only the first component of a
+        disconnected formula is used, as ranks start again in every
+        component. Tables are kept in formula_cache, so the formula of a
+        core is only decoded once. """
+
+    atoms = formula_cache.get(formula)
+    if atoms is None:
+        counts = {}  # {element: count} in the order of the formula
+        for element, count in parse_formula(formula.split(".")[0]):
+            counts[element] = counts.get(element, 0)+count
+        atoms = tuple(element for element, count in counts.items()
+                      if element != "H" for i in range(count))
+        formula_cache.put(formula, atoms)
+    return atoms
+
+class InChILayers(object):
+
+    """ An inchi as a list of layers, e.g.
+        "InChI=1S/C6H6O/c7-6-4-2-1-3-5-6/h1-5,7H/i1+1" gives
+        prefix "InChI=1S", formula "C6H6O" and the layers
+        [("c", "7-6-4-2-1-3-5-6"), ("h", "1-5,7H"), ("i", "1+1")].
+        A layer is found by its letter in O(1) (the first one with that
+        letter: the layers of the isotopic, fixed-H or reconnected parts
+        repeat the letters of the main layers). str() gives the inchi
+        back. """
+
+    def __init__(self, inchi):
+
+        parts = inchi.split("/")
+        self.prefix = parts[0]
+        self.formula = parts[1] if len(parts) > 1 else ""
+        self.layers = [(part[:1], part[1:]) for part in parts[2:]]
+        self.reindex()
+
+    def reindex(self):
+
+        # position of the first layer with every letter
+        self.index = {}
+        for position, (name, content) in enumerate(self.layers):
+            self.index.setdefault(name, position)
+
+    def __str__(self):
+
+        parts = [self.prefix, self.formula]
+        parts += [name+content for name, content in self.layers]
+        return "/".join(parts)
+
+    def __contains__(self, name):
+
+        return name in self.index
+
+    def layer(self, name, default=None):
+
+        # Content of the layer name (without its letter)
+        if name in self.index:
+            return self.layers[self.index[name]][1]
+        return default
+
+    def set_layer(self, name, content, before=(), after=()):
+
+        """ This function changes the content of the layer name. A missing
+            layer is added before the first of the layers in before, or
+            else after the last of the layers in after found, or else at
+            the end. """
+
+        if name in self.index:
+            self.layers[self.index[name]] = (name, content)
+            return
+        positions = [self.index[other] for other in before
+                     if other in self.index]
+        if len(positions) > 0:
+            position = min(positions)
+        else:
+            positions = [self.index[other]+1 for other in after
+                         if other in self.index]
+            position = max(positions) if len(positions) > 0 else len(self.layers)
+        self.layers.insert(position, (name, content))
+        self.reindex()
+
+    def remove_layer(self, name):
+
+        # Remove the layer name if there is one
+        if name in self.index:
+            del self.layers[self.index[name]]
+            self.reindex()
+
+    def isotopes(self):
+
+        """ This function returns the isotopic layer as a dict
+            {atom rank: label} in order, e.g. "1+1,3-1,5D" gives
+            {1: "+1", 3: "-1", 5: "D"}. """
+
+        isotopes = {}
+        content = self.layer("i", "")
+        for part in content.split(",") if content != "" else []:
+            end = 0
+            while end < len(part) and part[end].isdigit():
+                end += 1
+            isotopes[int(part[:end])] = part[end:]
+        return isotopes
+
+    def set_isotopes(self, isotopes):
+
+        """ This function writes the isotopic layer from a dict
+            {atom rank: label} (see isotopes) in one go, sorting the atoms.
+            The layer is added after the main layers (before /f and /r) if
+            there was none, and removed if isotopes is empty. """
+
+        if len(isotopes) == 0:
+            self.remove_layer("i")
+            return
+        content = ",".join(str(rank)+isotopes[rank]
+                           for rank in sorted(isotopes))
+        self.set_layer("i", content, before=("f", "r"))
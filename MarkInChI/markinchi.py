@@ -1,248 +1,650 @@
 import sys, os
+# the syntax is checked without RDKit (see validate.py): callers that only
+# have to reject malformed markinchis use it without importing this module
+from validate import MarkInChISyntaxError, validate
 from rdkit import Chem
-import copy
-from label import Label
+import random
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+from label import Label, LABELLINGS, isotopes_fit, isotope_masses, fragment_cache, atom_labels, clear_bond_stereo
+from cache import LRUCache
+from layers import atom_table, formula_cache, parse_formula
+from plan import Plan
+from dedup import Deduplicator
+from expansion import Expansion
+from template import Template
+from instrumentation import get_logger, lazy
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'markmol2markinchi'))
 from zz_convert import zz_convert
 
+logger = get_logger("markinchi")
+
+OUTPUTS = ("inchi", "inchikey", "smiles", "mol")  # formats of the members
+EXECUTORS = ("process", "thread")  # parallel modes (see run_parallel)
+
+# Prepared cores shared by all the MarkInChI instances of the process
+# {(core inchi, labelled attachments): (inchi, ranks, core_mol)}, see
+# MarkInChI.prepare_core
+core_cache = LRUCache(maxsize=256)
+
+def cache_info():
+
+    # Statistics of the caches of the process
+    return {"cores": core_cache.info(), "fragments": fragment_cache.info(),
+            "formulas": formula_cache.info()}
+
+def expand_prefix(markinchi, prefix, output="inchi", labelling=None,
+                  template=True, memory=None, directory=None):
+
+    # Worker of the process mode: every process builds its own MarkInChI
+    # (and so its own Label and RDKit molecules) and expands only the
+    # combinations starting with the substitutions in prefix
+    inchi_obj = MarkInChI(markinchi, lazy=True, output=output,
+                          labelling=labelling, template=template)
+    return inchi_obj.expand_part(prefix, memory, directory)
+
 class MarkInChI(object):
 
-    def __init__(self, inchi):
+    def __init__(self, inchi, lazy=False, workers=1, output="inchi",
+                 memory=None, symmetry=False, executor="process",
+                 labelling=None, template=True):
 
-        zz = zz_convert()
-        inchi = inchi.replace("MarkInChI", "InChI", 1)
-        # Check it is actually a markinchi
-        if inchi.find("<M>") == -1:
-            print("Not a MarkInChI")
-        else:
-            inchiplus = inchi.split("<M>")
+        # If lazy is True the single inchis are not produced here and
+        # should be obtained with iter_inchis()
+        # If workers > 1 the expansion is run on that many processes, or
+        # threads if executor is "thread"
+        # output is the format of the members (see OUTPUTS and finalise)
+        # memory is the budget (bytes) of the keys used to remove duplicates
+        # before they are written to disk (see dedup.Deduplicator), and of
+        # every part expanded with workers > 1 (see expand_part)
+        # If symmetry is True the substitutions of the first block on atoms
+        # symmetric to an earlier one are not expanded (see symmetric). It
+        # is off by default: it ranks the atoms of every core and saves
+        # nothing on markinchis whose attachments have no symmetric atoms
+        # labelling is how the replaced atoms of the core are labelled (see
+        # LABELLINGS): by default isotopes, or atom map numbers if their
+        # labels could be mixed up with the others (see default_labelling)
+        # If template is True a markinchi with only R groups is expanded by
+        # filling a smiles template of the core (see template.Template)
+        # Once built the instance is not modified: every expansion keeps
+        # its state in its own Expansion (see run), so one instance can be
+        # expanded by several threads at once
+        if output not in OUTPUTS:
+            raise ValueError(f"unknown output {output!r}, expected one of {OUTPUTS}")
+        if executor not in EXECUTORS:
+            raise ValueError(f"unknown executor {executor!r}, expected one of {EXECUTORS}")
+        if labelling is not None and labelling not in LABELLINGS:
+            raise ValueError(f"unknown labelling {labelling!r}, expected one of {LABELLINGS}")
+        self.markinchi = inchi  # store the markinchi for the workers
+        self.labelling = labelling
+        self.output = output
+        self.list_of_inchi = []  # list of produced single inchis
+        self.inchiplus = []  # list of substituent blocks
+        self.grouplists = []  # substitutions of every block
+        self.pruned = frozenset()  # indices of the first block not expanded
+        self.template = None  # smiles template of the core if it has one
+        # Check it is actually a markinchi before anything is parsed (raises
+        # a validate.MarkInChISyntaxError giving the position of the error)
+        validate(inchi)
+        # Parse the core and the blocks once
+        self.plan = Plan(inchi)
+        self.inchiplus = [block.text.replace("Zz", "Te")
+                          for block in self.plan.blocks]
+        self.grouplists = [block.substitutions
+                           for block in self.plan.blocks]
+        if labelling is None:
+            labelling = self.default_labelling()
+        self.labelling = labelling
+        # create an instance of the labelling class
+        self.label = Label(labelling)
+        # labelled core (shared with the other instances)
+        self.inchi, self.ranks, self.core_mol = self.prepare_core()
+        # symbol of the atom of every rank of the core
+        self.atoms = atom_table(self.inchi.split("/")[1])
+        if symmetry:
+            self.pruned = self.symmetric()
+        if template:
+            self.template = Template.compile(self)
+        if not lazy:
+            # run alogrithm and store the resulted list of single inchis
+            self.list_of_inchi = list(self.iter_inchis(workers, memory,
+                                                       executor=executor))
+            logger.info("Number of inchi produced: %d",
+                        len(self.list_of_inchi))
+
+    def default_labelling(self):
+
+        # "isotope" if the replaced atoms of the core can be labelled with
+        # isotopes without their labels being mixed up with the labels of
+        # the atoms bonded to the substituents (see label.isotopes_fit),
+        # else "map"
+        ranks = [rank for block in self.plan.blocks
+                 for rank, hydrogen in block.attachments]
+        atoms = atom_table(self.plan.core.split("/")[1])
+        elements = set(atoms)
+        for block in self.plan.blocks:
+            for substituent in block.substituents:
+                formula = substituent.text.split("/")[0]
+                elements.update(element for element, count
+                                in parse_formula(formula))
+        if isotopes_fit(atoms, ranks, elements):
+            return "isotope"
+        return "map"
+
+    def prepare_core(self):
+
+        """ This function returns the core inchi (Zz written as Te), the
+            labels of the ranks of the atoms that are replaced {rank:label}
+            and the labelled core molecule. They only depend on the core,
+            on the ranks used by the blocks and on the labelling, so they
+            are kept in core_cache and shared by the markinchis with the
+            same core and attachments (e.g. a library differing only in
+            substituents). They must not be modified. """
+
+        attachments = tuple((block.kind, tuple(block.attachments))
+                            for block in self.plan.blocks
+                            if block.kind != "R group")
+        key = (self.plan.core, attachments, self.labelling)
+        core = core_cache.get(key)
+        if core is None:
             # Get main InChI and substituents
-            inchiplus_item = inchiplus.pop(0)  # inchiplus_item = main_inchi
-            if inchiplus_item.find("Zz") != -1:
-                inchiplus_item = zz.zz_to_te(inchiplus_item)
-            # TODO: use zz_to_te instead
-            for sub in range(0, len(inchiplus)):
-                inchiplus[sub] = inchiplus[sub].replace("Zz", "Te")
-            self.inchi = inchiplus_item  # store original inchi
-            self.list_of_inchi = []  # list of produced single inchis
-            # create an instance of the labelling class
-            self.label = label = Label()
-            # isotopically label the inchi where replacements will occur
-            inchiplus_item, self.ranks = label.label_inchi(inchiplus_item,
-                                                                inchiplus)
-            print(f"after labelling: {inchiplus_item}")
-            print(f"ranks: {self.ranks}")
-            # Convert main inchi to mol
-            print(f"core_inchi: {inchiplus_item}")
-            main_mol = Chem.rdinchi.InchiToMol(inchiplus_item)[0]
+            inchi = self.plan.core
+            if inchi.find("Zz") != -1:
+                inchi = zz_convert().zz_to_te(inchi)
+            if self.labelling == "map":
+                # label the atoms of the mol where replacements will occur
+                main_mol, ranks = self.label.label_mol(inchi, self.inchiplus)
+            else:
+                # isotopically label the inchi where replacements will occur
+                labelled, ranks = self.label.label_inchi(inchi, self.inchiplus)
+                logger.debug("after labelling: %s", labelled)
+                # Convert main inchi to mol
+                main_mol = Chem.rdinchi.InchiToMol(labelled)[0]
+            logger.debug("ranks: %s", ranks)
             # Sanitize (only in rdkit)
-            new_mol = Chem.MolFromSmiles(Chem.MolToSmiles(main_mol))
-            # run alogrithm and then print the resulted list of single inchis
-            self.used_substituent = "0H-X"
-            self.run_count = 0
-            self.run(inchiplus, new_mol)
-            print(self.list_of_inchi)
-            print(f"Number of inchi produced: {len(self.list_of_inchi)}")
+            core_mol = Chem.MolFromSmiles(Chem.MolToSmiles(main_mol))
+            # double bonds as Label.sanitize keeps them
+            clear_bond_stereo(core_mol)
+            atom_labels(core_mol)  # built before it is shared
+            core = (inchi, ranks, core_mol)
+            core_cache.put(key, core)
+        return core
+
+    def iter_inchis(self, workers=1, memory=None, directory=None,
+                    executor="process"):
 
-    def replacement(self, main_mol, substituent):
+        """ This generator yields every single inchi of the markinchi as
+            soon as it is produced, skipping the ones already yielded.
+            Only the keys of the inchis seen so far are kept, in memory or
+            once they take more than memory bytes in a sorted file in
+            directory (see dedup.Deduplicator).
+            With workers > 1 the combinations are expanded in parallel
+            on processes or threads (see run_parallel) and yielded in the
+            same order. """
+
+        if len(self.inchiplus) == 0:
+            return
+        if workers > 1:
+            produced = self.run_parallel(workers, executor, memory, directory)
+        else:
+            produced = self.expand()
+        with self.deduplicator(memory, directory) as seen:
+            for new_inchi in produced:
+                # if it is a new inchi then yield it
+                if seen.add(self.dedup_key(new_inchi)):
+                    yield new_inchi
+
+    def deduplicator(self, memory=None, directory=None):
+
+        # Members are keyed by inchikey, or by a 64-bit hash of the smiles
+        if self.output in ("inchi", "inchikey"):
+            return Deduplicator("inchikey", memory, directory)
+        return Deduplicator("hash", memory, directory)
+
+    def dedup_key(self, member):
+
+        # Key telling apart the members: the string itself, or the smiles
+        # of a molecule for output "mol"
+        if self.output == "mol":
+            return Chem.MolToSmiles(member)
+        return member
+
+    def symmetric(self):
+
+        """ This function returns the indices of the substitutions of the
+            first block (if it is a variable attachment) that give the
+            same molecules as an earlier substitution of the block, as they
+            put the same substituent on atoms that are symmetric in the
+            core. Symmetry classes are the canonical ranks of the core
+            without labels (breakTies=False): the labelled atoms get back
+            the isotopes of the core inchi (see real_isotopes), and the
+            atoms used by the other blocks and the Zz atoms are each given
+            a different isotope so they can't be swapped. As the first
+            block is expanded first, run() would only produce duplicates
+            for them. """
+
+        if len(self.plan.blocks) == 0:
+            return set()
+        first = self.plan.blocks[0]
+        if first.kind != "variable attachment":
+            return set()
+        fixed = set()  # ranks used by the other blocks
+        for block in self.plan.blocks[1:]:
+            fixed.update(str(rank) for rank, hydrogen in block.attachments)
+        # labelled atom of every rank {(label, symbol): rank}
+        labels = {(label, self.atoms[int(rank)-1].upper()): rank
+                  for rank, label in self.ranks.items()}
+        isotopes = self.real_isotopes()
+        mol = Chem.Mol(self.core_mol)
+        atoms = {}  # {rank: atom index}
+        colour = 1000  # isotopes given to the atoms that can't be swapped
+        for atom in mol.GetAtoms():
+            label = self.label.core_label(atom)
+            rank = labels.get((label, atom.GetSymbol().upper()))
+            if rank is not None:
+                atoms[rank] = atom.GetIdx()
+            atom.SetAtomMapNum(0)
+            if rank in fixed or atom.GetSymbol() == "Te":
+                colour += 1
+                atom.SetIsotope(colour)
+            elif rank is not None:
+                # labels replaced by the isotopes of the core (the other
+                # atoms already have theirs)
+                atom.SetIsotope(isotopes.get(int(rank), 0))
+        classes = list(Chem.CanonicalRankAtoms(mol, breakTies=False))
+        pruned = set()
+        done = set()  # (symmetry class, substituent) already expanded
+        for index, substitution in enumerate(first.substitutions):
+            rank = str(substitution.rank)
+            if rank not in atoms:
+                continue
+            key = (classes[atoms[rank]], substitution.kind,
+                   substitution.substituent.text)
+            if key in done:
+                pruned.add(index)
+            done.add(key)
+        logger.debug("symmetric substitutions: %s", pruned)
+        return frozenset(pruned)
+
+    def real_isotopes(self):
+
+        # Isotopes of the atoms of the core inchi before labelling
+        # {rank: mass}, the labels of label_inchi replacing them
+        inchi = self.plan.core
+        if inchi.find("Zz") != -1:
+            inchi = zz_convert().zz_to_te(inchi)
+        return isotope_masses(inchi)
+
+    def replacement(self, main_mol, substitution):
 
         # This function performs replacements on atoms "-"
-        # substituent = rank-atom@replacement or rankH-replacement
+        # substitution of kind "atom" (rank-atom@replacement) or
+        # "hydrogen" (rankH-replacement)
         No_H = True  # True if replacement atom is not H
-        new_mol = copy.deepcopy(main_mol)
-        id = substituent.split("-", 1)
-        if "H" not in id[0]:
-            rank = id[0]
-            atom, replacement = tuple(id[1].split("@"))
-            # Code below cannot be used because it splits numbers into digits for id[0]
-            # rank, atom, replacement = tuple(id[0]) + tuple(id[1].split("@"))
-            replacement = Chem.MolFromSmiles(replacement).GetAtoms()[0]
+        new_mol = main_mol  # main_mol is only copied when it is modified
+        rank = str(substitution.rank)
+        replacement = substitution.substituent
+        if substitution.kind == "atom":
+            atom = substitution.atom
+            # copy the atom as the fragment molecule is shared
+            replacement = Chem.Atom(self.label.fragment(replacement.fragment)[0].GetAtomWithIdx(0))
         else:
-            rank, replacement = tuple(id)
             # find the atom from the rank
-            atom = self.label.find_atom(rank[:-1], self.inchi.split("/")[1])
-            if replacement != "H":
+            atom = self.atoms[int(rank)-1]
+            if not replacement.is_hydrogen:
                 # convert replacement to an Atom() object
-                if len(replacement) == 1:
-                    self.one_atom = Chem.MolFromSmiles(replacement)
-                    replacement = Chem.MolFromSmiles(replacement).GetAtoms()[0]
+                fragment = self.label.fragment(replacement.fragment)
+                if len(replacement.text) == 1:
+                    one_atom = fragment[0]
+                    replacement = Chem.Atom(one_atom.GetAtomWithIdx(0))
                 else:
-                    self.one_atom = None
-                    sub_inchi = "InChI=1B/" + replacement  # convert to inchi
-                    sub_mol = Chem.rdinchi.InchiToMol(sub_inchi)[0]
+                    one_atom = None
             else:
                 No_H = False
         is_aromatic = False  # false if atom being replaced is not aromatic
-        # get atomic mass for the atom being replaced
-        table = Chem.GetPeriodicTable()
-        atomic_mass = int(table.GetMostCommonIsotopeMass(atom))
+        labels = atom_labels(main_mol)  # indices of the labelled atoms
         if No_H:
             # normal replacement no H
-            if "H" not in rank:
+            if substitution.kind == "atom":
                 # get isotopic label of atom being replaced
                 num = int(self.ranks[rank])
-                print(f"ranks: {self.ranks}")
-                print(f"num: {num}")
-                print(f"symbol: {atom}")
-                for mol_atom in new_mol.GetAtoms():
-                    cn1 = mol_atom.GetIsotope() == num
-                    cn2 = mol_atom.GetSymbol() == str.upper(atom)
-                    if cn1 and cn2:
+                logger.debug("num: %d, symbol: %s", num, atom)
+                for idx in self.label.find_label(main_mol, num, labels):
+                    mol_atom = main_mol.GetAtomWithIdx(idx)
+                    if mol_atom.GetSymbol() == str.upper(atom):
                         # Replace the labelled atom
                         is_aromatic = mol_atom.GetIsAromatic()
                         replacement.SetIsAromatic(is_aromatic)
-                        rwmol = Chem.RWMol(new_mol)
-                        idx = mol_atom.GetIdx()
-                        rwmol.ReplaceAtom(idx, replacement)
-                        new_mol = copy.deepcopy(rwmol.GetMol())
+                        if new_mol is main_mol:
+                            new_mol = Chem.RWMol(main_mol)
+                            new_mol.labels = labels.copy()
+                        new_mol.ReplaceAtom(idx, replacement)
+                        new_mol.labels.set(idx, replacement)
             else:
                 # get isotopic label of atom being replaced
-                num = int(self.ranks[rank[:-1]])
+                num = int(self.ranks[rank])
                 # smiles.replace("[C]","C")
                 # new_mol = Chem.MolFromSmiles(smiles)
-                rwmol = Chem.RWMol(new_mol)
-                new_rwmol = copy.deepcopy(rwmol)
-                for mol_atom in rwmol.GetAtoms():
-                    cn1 = mol_atom.GetIsotope() == num
-                    cn2 = mol_atom.GetSymbol() == str.upper(atom)
-                    if cn1 and cn2:
+                new_rwmol = None  # copy of main_mol, made when needed
+                for idx in self.label.find_label(main_mol, num, labels):
+                    mol_atom = main_mol.GetAtomWithIdx(idx)
+                    if mol_atom.GetSymbol() == str.upper(atom):
                         # Replace the labelled atom to og and add new atom
-                        iso_num = self.label.find_isotope(self.inchi, rank[:-1])
-                        idx = mol_atom.GetIdx()
+                        iso_num = self.label.find_isotope(self.inchi, rank)
                         is_aromatic = mol_atom.GetIsAromatic()
-                        add_index = rwmol.GetNumAtoms()
-                        if self.one_atom != None:
+                        add_index = main_mol.GetNumAtoms()
+                        if one_atom != None:
                             # If var attach is larger than XHn
-                            new_rwmol.AddAtom(replacement)
-                            new_rwmol.GetAtoms()[idx].SetIsotope(iso_num)
+                            if new_rwmol is None:
+                                new_rwmol = Chem.RWMol(main_mol)
+                                new_rwmol.labels = labels.copy()
+                            new_index = new_rwmol.AddAtom(replacement)
+                            new_rwmol.labels.set(new_index, replacement)
+                            self.label.unlabel_bonded(new_rwmol.GetAtomWithIdx(idx), iso_num)
+                            new_rwmol.labels.set(idx, new_rwmol.GetAtomWithIdx(idx))
                             single = Chem.rdchem.BondType.SINGLE
                             new_rwmol.AddBond(add_index, idx, order=single)
                             #new_rwmol = self.label.sanitize(new_rwmol)
-                            new_mol = copy.deepcopy(new_rwmol.GetMol())
+                            new_mol = new_rwmol
                         else:
-                            final_mol = self.label.combine(new_rwmol, sub_mol, num)
+                            # combine_fragment doesn't modify main_mol
+                            final_mol = self.label.combine_fragment(main_mol, fragment[1], fragment[2], num, iso_num)
                             new_mol = final_mol
-        print(f"new_mol: {Chem.MolToSmiles(new_mol)}")
-        new_mol = self.label.sanitize_charges(new_mol)
-        return copy.deepcopy(new_mol)
+        if new_mol is main_mol:
+            # nothing replaced: copy as sanitize_charges modifies new_mol
+            new_mol = Chem.Mol(main_mol)
+            new_mol.labels = labels
+        logger.debug("new_mol: %s", lazy(Chem.MolToSmiles, new_mol))
+        return self.label.sanitize_charges(new_mol)
 
     def replace(self, main_mol, substituent):
         # This function replaces undefined atoms
         # Case not hydrogen
         final_mol = None
-        if substituent != "" and substituent != "H":
-            sub_inchi = ""
-            sub_mol = None
+        if not substituent.is_hydrogen:
             # We assume that the markinchi will be either:
             # 1- one atom that is convertable to a smiles and then to
-            # an Atom()
+            # an Atom() (converted to Mol() rather than Atom() to preserve
+            # its properties)
             # 2- more than one atom written in the format of a "part-inchi"
-            if substituent.find("/") != -1:
-                # case 2
-                sub_inchi = "InChI=1B/"+substituent  # convert to inchi
-                sub_mol = Chem.rdinchi.InchiToMol(sub_inchi)[0]
-                final_mol = self.label.combine(main_mol, sub_mol)
-            else:
-                # case 1: atom
-                # convert it to Mol() rather than Atom() to preserve
-                # its properties
-                sub_mol = Chem.MolFromSmiles(substituent)
-                final_mol = self.label.combine(main_mol, sub_mol)
+            # (see plan.RGroupBlock)
+            mol, sub_mol, sub_label = self.label.fragment(substituent.fragment)
+            final_mol = self.label.combine_fragment(main_mol, sub_mol, sub_label)
         else:
             # substituent is hydrogen: just delete "Te" in the core
             final_mol = self.label.delete_zz(main_mol)
         return final_mol
 
-    def run(self, inchiplus, main_mol):
-
-        # Algorithm
-        # Get first list of substituents and substitute in order
-        self.run_count += 1
-        print(f"inchiplus: {inchiplus} - {self.run_count}")
-        inchiplus_item = inchiplus.pop(0)  # first R group or change
-        # Treat attachment cases
-        attachments = []
-        # molecule will help us understand if we have replacement "-" or
-        # variable attachment "," case
-        molecule = inchiplus_item.split("!")[0].split("/")[0]
-        if "," in molecule:
-            # Get a clean list of attachments e.g. ["1H", "2H", "4H"...etc]
-            # or ["1", "2", "4"...etc]
-            attachments = molecule.split(",")
-            attachments[-1] = attachments[-1].split("-")[0]  # remove suffix
-            index = inchiplus_item.find("-")
-            suffix = inchiplus_item[(index+1):]  # part after "-"
-            suffix_list = suffix.split("!")  # R group replacements
-            inchiplus_item = ""
-            for number in attachments:
-                if "H" in number:  # v. attachment of hydrogen case
-                    main_atom = ""
-                else:
-                    # v. attachment of different atoms Example 3.ii
-                    main_atom = suffix_list[0]+"@"
-                # split substituent to several sub_substiutions and put it
-                # back in inchiplus_item
-                for suff in suffix_list:
-                    sub = number + "-" + main_atom + suff
-                    inchiplus_item += (sub+"!")
-            inchiplus_item = inchiplus_item[:-1]
+    def run_parallel(self, workers, executor="process", memory=None,
+                     directory=None):
+
+        """ This generator splits the combinations by the substitutions of
+            the first block (or of the first two blocks if the first one
+            has fewer substitutions than workers) and expands every part
+            in a ProcessPoolExecutor, or in a ThreadPoolExecutor sharing
+            this instance if executor is "thread" (RDKit releases the GIL
+            in some of its functions, and nothing has to be parsed again
+            or sent between processes). Parts are yielded in the order of
+            their prefix, which is the order run() would produce them in.
+            memory and directory are the budget of the keys of every part
+            (see expand_part). """
+
+        sizes = [len(grouplist) for grouplist in self.grouplists[:2]]
+        # substitutions of the first block in self.pruned give no new inchi
+        first = [i for i in range(sizes[0]) if i not in self.pruned]
+        prefixes = [(i,) for i in first]
+        if len(prefixes) < workers and len(sizes) > 1:
+            prefixes = [(i, j) for i in first for j in range(sizes[1])]
+        if executor == "thread":
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for part in pool.map(self.expand_part, prefixes,
+                                     repeat(memory), repeat(directory)):
+                    yield from part
+            return
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = pool.map(expand_prefix, repeat(self.markinchi),
+                             prefixes, repeat(self.output),
+                             repeat(self.labelling),
+                             repeat(self.template is not None),
+                             repeat(memory), repeat(directory))
+            for part in parts:
+                yield from part
+
+    def expand_part(self, prefix, memory=None, directory=None):
+
+        # This function returns the different inchis of the combinations
+        # starting with the substitutions in prefix (see run_parallel). The
+        # keys are spilled to disk past memory bytes as in iter_inchis, but
+        # the inchis of the part are kept in memory until they are returned
+        part = []
+        with self.deduplicator(memory, directory) as seen:
+            for new_inchi in self.expand(prefix):
+                if seen.add(self.dedup_key(new_inchi)):
+                    part.append(new_inchi)
+        return part
+
+    def substitute(self, main_mol, substitution):
+
+        # This function returns a new molecule with one substitution of a
+        # block (see plan.Substitution) applied to main_mol. main_mol is not
+        # modified so it can be shared by all the substitutions of a block
+        logger.debug("substituent: %s", substitution)
+        logger.debug("before substitution: %s", lazy(Chem.MolToSmiles, main_mol))
+        if substitution.kind != "R group":
+            # replace normal atom "-"
+            new_mol = self.replacement(main_mol, substitution)
         else:
-            # only atom replacement case
-            if "-" in molecule:
-                # rank = canonical inchi number of atom to be replaced
-                rank = molecule.split("-")[0]
-                index = inchiplus_item.find("-")
-                suffix = inchiplus_item[index+1:]  # part after "-"
-                suffix_list = suffix.split("!")  # list of atoms
-                atom = suffix_list[0]  # atom to be replaced
-                inchiplus_item = ""
-                for suff in suffix_list:
-                    # e.g. 1-C@N (change C with canonical no. 1 to N)
-                    sub = rank + "-" + atom + "@" + suff
-                    inchiplus_item += (sub+"!")
-                inchiplus_item = inchiplus_item[:-1]  # remove "!" at the end
-        # split instances of R group separated by "!"
-        grouplist=inchiplus_item.split("!")
-        print(f"grouplist: {grouplist}")
-        for substituent in grouplist:
-            if substituent.split("-")[0] == self.used_substituent.split("-")[0]:
-                print(self.used_substituent)
-                print(substituent)
+            # replace Zz atom
+            new_mol = self.replace(main_mol, substitution.substituent)
+        logger.debug("after substitution: %s", lazy(Chem.MolToSmiles, new_mol))
+        return new_mol
+
+    def finalise(self, new_mol, output=None):
+
+        # This function converts a molecule once all the substitutions are
+        # done into the output format (self.output if output is None), see
+        # convert, after removing the labels
+        new_mol = self.label.sanitize_labels(self.ranks, self.inchi, new_mol)
+        # sanitize_labels returns a copy
+        new_mol = self.label.sanitize(new_mol, in_place=True)
+        return self.convert(new_mol, output)
+
+    def convert(self, new_mol, output=None):
+
+        # This function converts a molecule without labels into the output
+        # format (self.output if output is None), doing only the
+        # conversions needed:
+        # - "inchi": inchi of the molecule without labels
+        # - "inchikey": key computed from the inchi string
+        # - "mol"/"smiles": the molecule without labels sanitized by RDKit
+        #   (and its canonical smiles). If RDKit can't sanitize it (e.g. a
+        #   hydrogen count left over by a substitution) the molecule is
+        #   read back from its inchi, which normalises it.
+        if output is None:
+            output = self.output
+        if output in ("mol", "smiles"):
+            flags = Chem.SanitizeMol(new_mol, catchErrors=True)
+            if flags != Chem.SanitizeFlags.SANITIZE_NONE:
+                new_mol = Chem.MolFromInchi(Chem.MolToInchi(new_mol))
+            if output == "mol":
+                return new_mol
+            return Chem.MolToSmiles(new_mol)
+        new_inchi = Chem.MolToInchi(new_mol)
+        logger.debug("new_inchi: %s", new_inchi)
+        if output == "inchikey":
+            return Chem.InchiToInchiKey(new_inchi)
+        return new_inchi
+
+    def decode(self, k):
+
+        # This function converts the index k of a combination into the
+        # index of the substitution used in every block (mixed radix with
+        # the last block changing fastest, which is the order of run())
+        sizes = [len(grouplist) for grouplist in self.grouplists]
+        total = 1
+        for size in sizes:
+            total *= size
+        if k < 0 or k >= total:
+            raise IndexError(f"member {k} out of range (0-{total-1})")
+        choices = []
+        for size in reversed(sizes):
+            k, choice = divmod(k, size)
+            choices.insert(0, choice)
+        return tuple(choices)
+
+    def encode(self, choices):
+
+        # This function is the inverse of decode()
+        k = 0
+        for grouplist, choice in zip(self.grouplists, choices):
+            k = k*len(grouplist)+choice
+        return k
+
+    def is_skipped(self, choices):
+
+        # This function tells if run() skips a combination because a
+        # substitution has the same attachment as the one of the previous
+        # block. run() resets used_substituent once a substitution is fully
+        # expanded, so only the substitutions before the first one expanded
+        # in a block are compared with the previous block.
+        if choices[0] in self.pruned:
+            return True
+        last = len(choices)-1
+        for level in range(1, len(choices)):
+            used = self.grouplists[level-1][choices[level-1]].used_key
+            grouplist = self.grouplists[level]
+            if level != last:
+                for substitution in grouplist[:choices[level]]:
+                    if substitution.key != used:
+                        used = None
+                        break
+            if grouplist[choices[level]].key == used:
+                return True
+        return False
+
+    def member(self, k):
+
+        """ This function produces the inchi of the k-th combination of
+            substitutions (k starts at 0, in the order of run()) without
+            producing the combinations before it. It returns None if run()
+            skips that combination. Duplicates are not removed, the same
+            inchi can be produced by different k. """
+
+        return self.combination(self.decode(k))
+
+    def combination(self, choices):
+
+        # This function produces the inchi of a combination given the index
+        # of the substitution of every block, or None if run() skips it
+        # The substituents of consecutive R group blocks are attached in
+        # one edit (see Label.attach)
+        if self.is_skipped(choices):
+            return None
+        new_mol = self.core_mol
+        fragments = []  # R groups not attached yet
+        for grouplist, choice in zip(self.grouplists, choices):
+            substitution = grouplist[choice]
+            if substitution.kind == "R group":
+                substituent = substitution.substituent
+                if substituent.is_hydrogen:
+                    fragments.append((None, None))
+                else:
+                    mol, sub_mol, sub_label = self.label.fragment(substituent.fragment)
+                    fragments.append((sub_mol, sub_label))
                 continue
-            if substituent == "H":  # make H implicit
-                substituent = ""
-            new_mol = copy.deepcopy(main_mol)
-            new_inchi = ""
-            print(f"substituent: {substituent}")
-            print(f"before substitution: {Chem.MolToSmiles(new_mol)}")
-            if "-" in substituent.split("/")[0]:
-                # replace normal atom "-"
-                new_mol = self.replacement(new_mol, substituent)
-                print(f"after substitution: {Chem.MolToSmiles(new_mol)}")
-            else:
-                # replace Zz atom
-                new_mol = self.replace(new_mol, substituent)
-                print(f"after substitution: {Chem.MolToSmiles(new_mol)}")
-            if len(inchiplus) == 0:  # if finished substitutions
-                # produce inchi
-                new_mol = copy.deepcopy(self.label.sanitize_labels(self.ranks, self.inchi, new_mol))
-                new_inchi = Chem.MolToInchi(self.label.sanitize(new_mol))
-                molecule = Chem.MolFromInchi(new_inchi)
-                print(f"new_inchi: {new_inchi}")
-                # if it is a new inchi then put it in the list
-                if new_inchi not in self.list_of_inchi:
-                    self.list_of_inchi.append(new_inchi)
+            if len(fragments) > 0:
+                new_mol = self.label.attach(new_mol, fragments)
+                fragments = []
+            new_mol = self.substitute(new_mol, substitution)
+        if len(fragments) > 0:
+            new_mol = self.label.attach(new_mol, fragments)
+        return self.finalise(new_mol)
+
+    def members(self, indices):
+
+        """ This generator yields the inchis of the combinations in
+            indices (e.g. range(1000000, 1100000)) using member(),
+            leaving out the ones skipped by run(). """
+
+        for k in indices:
+            new_inchi = self.member(k)
+            if new_inchi is not None:
+                yield new_inchi
+
+    def sample(self, n, seed=None, stratified=False):
+
+        """ This function returns n different single inchis picked at
+            random, producing only the sampled combinations. Combinations
+            are drawn uniformly without replacement, or if stratified is
+            True so that the substitutions of every block are used equally
+            often. Combinations skipped by run() and inchis already sampled
+            (e.g. symmetric substitutions) are replaced by new draws.
+            Fewer than n inchis are returned only if all the combinations
+            have been drawn. The same seed gives the same sample. """
+
+        rng = random.Random(seed)
+        sizes = [len(grouplist) for grouplist in self.grouplists]
+        total = 1
+        for size in sizes:
+            total *= size
+        if len(sizes) == 0:
+            total = 0
+        decks = [[] for size in sizes]  # used by the stratified mode
+        drawn = set()  # indices of the combinations drawn
+        sampled = []
+        seen = set()
+        while len(sampled) < n and len(drawn) < total:
+            if stratified:
+                # take the next substitution of every block from a
+                # shuffled deck refilled when empty
+                choices = []
+                for size, deck in zip(sizes, decks):
+                    if len(deck) == 0:
+                        deck.extend(rng.sample(range(size), size))
+                    choices.append(deck.pop())
+                k = self.encode(choices)
             else:
-                self.used_substituent = copy.copy(substituent)
-                # There is still more substitutions then continue
-                # with current mol and inchiplus
-                new_inchiplus = inchiplus.copy()
-                self.run(new_inchiplus, new_mol)
-                self.used_substituent = "0H-X"
-        return
+                k = rng.randrange(total)
+            if k in drawn:
+                continue
+            drawn.add(k)
+            new_inchi = self.combination(self.decode(k))
+            if new_inchi is None:
+                continue
+            key = self.dedup_key(new_inchi)
+            if key not in seen:
+                seen.add(key)
+                sampled.append(new_inchi)
+        return sampled
+
+    def expand(self, prefix=()):
+
+        # Iterable yielding the output of every combination starting with
+        # the substitutions in prefix, duplicates included, from the smiles
+        # template if there is one or else from run()
+        if self.template is not None:
+            return self.template.expand(prefix)
+        return self.run(prefix)
+
+    def run(self, prefix=(), checkpoint=None):
+
+        # Iterable yielding the inchi of every combination of substituents,
+        # duplicates included (see expansion.Expansion). prefix holds the
+        # indices of the substitutions used for the first blocks (see
+        # run_parallel) and checkpoint is the state returned by
+        # Expansion.checkpoint() to resume an expansion
+        return Expansion(self, prefix, checkpoint)
 
 if __name__=="__main__":
     # Only run the code below if this class is run directly by python not gui
     # Correct InChI syntax to work with rdkit
     inchi = input("Please enter the MarkInChI: ")
-    inchi_obj = MarkInChI(inchi)
+    try:
+        # validated by MarkInChI before anything is parsed
+        inchi_obj = MarkInChI(inchi)
+    except MarkInChISyntaxError as error:
+        print(error)
+        print(error.pointer())
+        sys.exit(1)
+    print(inchi_obj.list_of_inchi)
+    print(f"Number of inchi produced: {len(inchi_obj.list_of_inchi)}")
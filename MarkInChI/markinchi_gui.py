@@ -14,6 +14,7 @@ import copy
 from rdkit import Chem
 from rdkit.Chem import Draw
 from markinchi import MarkInChI
+from validate import MarkInChISyntaxError, validate
 from label import Label
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'markmol2markinchi'))
 from zz_convert import zz_convert
@@ -101,12 +102,12 @@ class MarkinchiGuiApp(object):
         entry = self.entry
         self.listbox.delete(0, END)
         markinchi = entry.get()
-        c_a = markinchi.find("<>") != -1
-        c_b = markinchi.find("MarkInChI") == -1
-        if markinchi.find("<M>") == -1 or c_a or c_b:
+        try:
+            validate(markinchi)
+        except MarkInChISyntaxError as error:
             # Error Message
             msg = "Please enter a valid MarkInChI with correct separators <M>"
-            messagebox.showerror("Error", msg)
+            messagebox.showerror("Error", msg+"\n"+str(error))
         else:
             try:
                 list_of_inchi = self.get_inchis(markinchi)
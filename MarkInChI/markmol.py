@@ -4,6 +4,11 @@ import sys
 from rdkit import Chem
 from zz_convert import zz_convert
 from label import Label
+from layers import InChILayers, atom_table
+from elements import ATOMIC_NUMBERS, INCHI_MASSES
+from instrumentation import get_logger
+
+logger = get_logger("markmol")
 
 class MarkMol(object):
 
@@ -81,8 +86,8 @@ class MarkMol(object):
         subst_dict = dict(sorted(subst_dict.items(), key=lambda item: item[0]))
         self.Rsubstituents = list(subst_dict.values()) + other_subst
 
-        # Create the MarkInChI and print it
-        print(self.produce_markinchi())
+        # Create the MarkInChI (stored in self.markinchi_final)
+        logger.info("MarkInChI: %s", self.produce_markinchi())
 
     def convert(self, content):
 
@@ -381,11 +386,11 @@ class MarkMol(object):
         for sub_attach in attachments:
             sub_attach.sort()
 
-        print(f"empty_inds: {self.empty_inds}")
-        print(f"attachments: {attachments}")
-        print(f"real_bonds: {real_bonds}")
-        print(f"attach_ids: {attach_ids}")
-        print(f"atom_symbols: {self.atom_symbols}")
+        logger.debug("empty_inds: %s", self.empty_inds)
+        logger.debug("attachments: %s", attachments)
+        logger.debug("real_bonds: %s", real_bonds)
+        logger.debug("attach_ids: %s", attach_ids)
+        logger.debug("atom_symbols: %s", self.atom_symbols)
 
         # Making some of the variables global
         self.attachments = attachments
@@ -468,9 +473,9 @@ class MarkMol(object):
             if int(atom) not in all_atoms:
                 all_atoms.append(int(atom))
         all_atoms.sort()
-        print(f"all_atoms: {all_atoms}")
+        logger.debug("all_atoms: %s", all_atoms)
 
-        print(f"no_atoms: {self.no_atoms}") # Total number of atoms
+        logger.debug("no_atoms: %s", self.no_atoms) # Total number of atoms
 
         i = 0  # Used for locating atoms in all_atoms
         if self.main_dict_renumber != {} and self.main_dict_renumber.values() != self.main_dict_renumber.keys():
@@ -496,7 +501,7 @@ class MarkMol(object):
                 i += 1
             new_atom_symbols = self.atom_symbols # No numbers were changed in all_atoms, so this doesn't need a change
 
-        print(f"all_atoms: {all_atoms}")
+        logger.debug("all_atoms: %s", all_atoms)
         no_labeled = str(len(all_atoms)) # Number of labeled atoms to add into M ISO line
         iso_line = f"M  ISO"
         iso_line += (3-len(no_labeled))*" "+no_labeled
@@ -504,12 +509,9 @@ class MarkMol(object):
         # Creates labels for connecting atoms to be put into M ISO line
         for atom in all_atoms:
             atom_sym = new_atom_symbols[atom] # Get the symbol of atom to be labeled
-            table = Chem.GetPeriodicTable()
-            atomic_mass = int(table.GetMostCommonIsotopeMass(atom_sym)) # Get its atomic mass from the periodic table
-            # TODO: Find a more elegant solution - F has atomic mass 19, RDKIT gives 18 (problem of RDKIT).
-            if atom_sym == 'F':
-                print("F in the molecule, RDKIT gives most common isotope mass as 18, but is 19. Inconsistent with the InChI algorithm.")
-                atomic_mass = 19
+            # Get the mass InChI gives to its atoms, so the label is read back
+            # as a shift of 5 + atom (see elements.inchi_mass)
+            atomic_mass = INCHI_MASSES[ATOMIC_NUMBERS[atom_sym]]
             label = str(atomic_mass + 5 + atom) # Generates a label
 
             # Creates M ISO line (M  ISO  no_labeled   atom   label   atom   label   atom   label),
@@ -531,18 +533,10 @@ class MarkMol(object):
 
         #### Deletes the isotope layer (/i) from the InChI - that accounts for connectivity
 
-        index = inchi.find("/i") # Find where is the isotope layer (-1 if is not there)
-
-        if index != -1: # If the index layer is present
-            suf = ""
-            if inchi[index+2:].find("/") != -1: # If the InChI continues after the /i layer
-                # suf will contain everything after the /i layer, starting with "/"
-                suf = "/"+"/".join(inchi[index+2:].split("/")[1:])
-            new_inchi = inchi[:index]+suf # Add together the parts before and after the isotope layer
-        else:
-            new_inchi = inchi # If the isotope layer is not there
+        layers = InChILayers(inchi) # InChI split into its layers
+        layers.remove_layer("i") # Nothing changes if the isotope layer is not there
 
-        return new_inchi
+        return str(layers)
 
     def relabel_sub(self, mol):
 
@@ -718,7 +712,7 @@ class MarkMol(object):
 
         # Adjustments for case of both R and XHn variable attachment, (it doesn't create a subblock for XHn),
         # but still needs to be treated as separate variable attachment
-        print(f"XHn_groups: {self.XHn_groups}")
+        logger.debug("XHn_groups: %s", self.XHn_groups)
         attach_ids_keys = [str(x) for x in self.attach_ids.keys()]
 
         # Removes XHn groups from attach_ids_keys
@@ -991,17 +985,19 @@ class MarkMol(object):
             else:
                 label_part = core_inchi[index + 2:]
 
+        # Symbols of the atoms of core_inchi in the order of their ranks
+        atoms = atom_table(core_inchi.split("/")[1])
+
         # Finding inchi labels of atoms with attachments from label_part
         for part in label_part.split(","):
             canonical_dict[part.split("+")[1]] = part.split("+")[0]
             rank = part.split("+")[0]
-            formula = core_inchi.split("/")[1]
             # Finding symbol of atom given by the rank from the molecular formula
-            symbol = self.help_label.find_atom(rank, formula)
+            symbol = atoms[int(rank)-1]
 
             if symbol == "Te":
                 # Creating list of atoms with R group attachments (not variable attachments)
-                order.append(str(int(part.split("+")[1]) - 6))
+                order.append(str(int(part.split("+")[1]) - 5))
             else:
                 # Creating lists of lists of atoms
                 if str(int(part.split("+")[1]) - 5) in self.list_of_atoms.keys():
@@ -1295,3 +1291,4 @@ class MarkMol(object):
 if __name__=="__main__":
     # Running the code independently
     mark_inchi_final = MarkMol("D:\\alexl\\Documents\\InChiMarkushTesting\\MarkInChI\\marvin\\test11a.sdf")
+    print(mark_inchi_final.markinchi_final)
@@ -0,0 +1,185 @@
+# This module parses a markinchi once into a plan: the core inchi and a list
+# of typed blocks with their substitutions. The plan drives the expansion in
+# MarkInChI and is shared by the other tools (e.g. Cardinality). It only
+# works on strings and doesn't import RDKit.
+
+class Substituent(object):
+
+    """ A group written in a block of a markinchi: "H", an atom ("Cl") or a
+        part-inchi ("C2H5Zz/c1-2-3/h2H2,1H3"). fragment is the string given
+        to Label.fragment() to get the molecule (Zz written as Te), or ""
+        for hydrogen. """
+
+    def __init__(self, text, as_inchi):
+
+        self.text = text
+        self.is_hydrogen = text == "H"
+        self.fragment = ""
+        if not self.is_hydrogen:
+            if as_inchi:
+                self.fragment = "InChI=1B/" + text.replace("Zz", "Te")
+            else:
+                self.fragment = text
+
+    def __repr__(self):
+
+        return self.text
+
+class Substitution(object):
+
+    """ One of the choices of a block:
+        - "R group": replace the Zz atom of the block by substituent
+        - "atom": replace the atom of canonical rank rank (symbol atom) by
+          the atom substituent
+        - "hydrogen": replace a hydrogen of the atom of canonical rank rank
+          by substituent
+        text is the substitution written as one string (e.g. "1H-C" or
+        "1-C@N") and key is the part compared between consecutive blocks to
+        avoid using the same attachment twice. """
+
+    def __init__(self, kind, text, substituent, rank=None, atom=None):
+
+        self.kind = kind
+        self.text = text
+        self.substituent = substituent
+        self.rank = rank  # int, None for R groups
+        self.atom = atom  # symbol of the replaced atom for "atom"
+        self.key = text.split("-")[0]
+        # key stored once this substitution is done (H is implicit)
+        self.used_key = "" if text == "H" else self.key
+
+    def __repr__(self):
+
+        return self.text
+
+class Block(object):
+
+    """ Base class of the blocks separated by <M> in a markinchi. """
+
+    kind = ""
+
+    def __init__(self, text):
+
+        self.text = text
+        self.attachments = []  # [(rank, hydrogen)] for atom blocks
+        self.substituents = []
+        self.substitutions = []
+
+    def size(self):
+
+        return len(self.substitutions)
+
+    def __repr__(self):
+
+        return f"{type(self).__name__}({self.text!r})"
+
+class RGroupBlock(Block):
+
+    """ List of substituents of a Zz atom e.g. "C!Cl!H" """
+
+    kind = "R group"
+
+    def __init__(self, text):
+
+        Block.__init__(self, text)
+        for item in text.split("!"):
+            # 1- one atom that is convertable to a smiles
+            # 2- more than one atom written in the format of a "part-inchi"
+            substituent = Substituent(item, "/" in item)
+            self.substituents.append(substituent)
+            self.substitutions.append(Substitution("R group", item,
+                                                   substituent))
+
+class AtomListBlock(Block):
+
+    """ List of atoms replacing the atom of a rank e.g. "1-C!N" (the first
+        atom is the one in the core) """
+
+    kind = "list of atoms"
+
+    def __init__(self, text):
+
+        Block.__init__(self, text)
+        rank, suffix = text.split("-", 1)
+        self.attachments = [(int(rank), False)]
+        self.atom = suffix.split("!")[0]  # atom to be replaced
+        for item in suffix.split("!"):
+            substituent = Substituent(item, False)
+            self.substituents.append(substituent)
+            # e.g. 1-C@N (change C with canonical no. 1 to N)
+            self.substitutions.append(Substitution(
+                "atom", rank+"-"+self.atom+"@"+item, substituent,
+                int(rank), self.atom))
+
+class VariableAttachmentBlock(Block):
+
+    """ Substituents attached to one of several atoms e.g. "1H,2H,4H-C!N"
+        (in place of a hydrogen) or "2,3,5-C!N" (replacing the atom, the
+        first substituent being the atom in the core) """
+
+    kind = "variable attachment"
+
+    def __init__(self, text):
+
+        Block.__init__(self, text)
+        index = text.find("-")
+        numbers = text[:index].split(",")
+        suffix_list = text[index+1:].split("!")
+        for number in numbers:
+            self.attachments.append((int(number.split("H")[0]),
+                                     "H" in number))
+        hydrogen = self.attachments[0][1]
+        for item in suffix_list:
+            # Atoms are smiles, other substituents of hydrogens part-inchis
+            as_inchi = hydrogen and len(item) != 1
+            self.substituents.append(Substituent(item, as_inchi))
+        for number, (rank, hydrogen) in zip(numbers, self.attachments):
+            for item, substituent in zip(suffix_list, self.substituents):
+                if hydrogen:
+                    self.substitutions.append(Substitution(
+                        "hydrogen", number+"-"+item, substituent, rank))
+                else:
+                    # v. attachment of different atoms Example 3.ii
+                    atom = suffix_list[0]
+                    self.substitutions.append(Substitution(
+                        "atom", number+"-"+atom+"@"+item, substituent,
+                        rank, atom))
+
+class Plan(object):
+
+    """ A markinchi parsed into its core inchi and blocks. Parsing is done
+        once; the substitutions of every block are then used for all the
+        combinations. """
+
+    def __init__(self, markinchi):
+
+        markinchi = markinchi.replace("MarkInChI", "InChI", 1)
+        inchiplus = markinchi.split("<M>")
+        self.core = inchiplus.pop(0)  # core inchi
+        self.blocks = [self.parse_block(item) for item in inchiplus]
+
+    def parse_block(self, item):
+
+        # molecule tells apart R groups, lists of atoms "-" and variable
+        # attachments ","
+        molecule = item.split("!")[0].split("/")[0]
+        if "," in molecule:
+            return VariableAttachmentBlock(item)
+        if "-" in molecule:
+            return AtomListBlock(item)
+        return RGroupBlock(item)
+
+    def sizes(self):
+
+        # Number of substitutions of every block
+        return [block.size() for block in self.blocks]
+
+    def total(self):
+
+        # Number of combinations of substitutions
+        if len(self.blocks) == 0:
+            return 0
+        total = 1
+        for size in self.sizes():
+            total *= size
+        return total
@@ -2,17 +2,22 @@
 # useful only if some atoms are replaced and MarkInChI is generated from different structures
 # should not happen because MarkInChI should be canonical
 
-import sys, os
-from markinchi import MarkInChI
+import sys
+from validate import MarkInChISyntaxError, validate
 
 class CompareMarkInChI(object):
 
     def __init__(self, inchi1, inchi2):
 
         # First check if they are MarkInChIs
-        if ("<M>" not in inchi1 or "MarkInChI" not in inchi1) or ("<M>" not in inchi2 or "MarkInChI" not in inchi2):
-            print("One or both inputs not MarkInChI")
-            sys.exit()
+        for inchi in (inchi1, inchi2):
+            try:
+                validate(inchi)
+            except MarkInChISyntaxError as error:
+                print("One or both inputs not MarkInChI")
+                print(error)
+                print(error.pointer())
+                sys.exit()
 
         # Compare lengths of the MarkInChIs
         if len(inchi1) == len(inchi2):
@@ -58,15 +63,11 @@ class CompareMarkInChI(object):
                 print("Not equivalent (different length, same core)")
                 sys.exit()
 
-        # Suppress printing
-        sys.stdout = open(os.devnull, 'w')
-
+        # RDKit is only imported if the markinchis have to be expanded
+        from markinchi import MarkInChI
         markinchi1 = MarkInChI(inchi1).list_of_inchi
         markinchi2 = MarkInChI(inchi2).list_of_inchi
 
-        #Enable printing
-        sys.stdout = sys.__stdout__
-
         markinchisorted1 = sorted(markinchi1)
         markinchisorted2 = sorted(markinchi2)
 
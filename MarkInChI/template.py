@@ -0,0 +1,215 @@
+import itertools
+import re
+from rdkit import Chem
+from label import clear_bond_stereo
+from instrumentation import get_logger
+
+logger = get_logger("template")
+
+# This module expands the markinchis whose blocks are all R groups on
+# terminal Zz atoms by string substitution, as markinchi2inchi.py does with
+# [TeH]: the core is written once as a smiles with a slot in place of every
+# Zz, the substituents are written once as smiles starting from the atom
+# bonded to Zz, and every member is a smiles parsed once by RDKit. The other
+# markinchis (atom lists, variable attachments...) are expanded on the
+# molecules (see MarkInChI.run).
+
+# Te atom of a core smiles numbered by its slot ("[Te:3]")
+SLOT = re.compile(r"\[Te:(\d+)\]")
+BONDS = "-=#$:/\\"  # bond symbols of a smiles
+RING_OFFSET = 1000  # ring bond numbers of the substituent of slot s start
+                    # at (s+1)*RING_OFFSET
+
+def renumber_rings(smiles, offset):
+
+    # This function adds offset to the ring bond numbers of a smiles
+    # (written "%(n)"), so it can be put in another smiles without reusing
+    # its numbers
+    parts = []
+    index = 0
+    while index < len(smiles):
+        char = smiles[index]
+        end = index+1
+        number = None  # ring bond number
+        if char == "[":
+            end = smiles.index("]", index)+1
+        elif char == "%" and smiles[index+1] == "(":
+            end = smiles.index(")", index)+1
+            number = int(smiles[index+2:end-1])
+        elif char == "%":
+            end = index+3
+            number = int(smiles[index+1:end])
+        elif char.isdigit():
+            number = int(char)
+        if number is None:
+            parts.append(smiles[index:end])
+        else:
+            parts.append("%(" + str(number+offset) + ")")
+        index = end
+    return "".join(parts)
+
+def stereo_neighbour(atom):
+
+    # True if the atom bonded to the Te atom is a stereocentre or in a
+    # double bond with stereochemistry (written as the directions of its
+    # bonds, see label.clear_bond_stereo): the molecules made by
+    # MarkInChI.run() don't keep their configuration (the bond to the new
+    # atom is added last), so such Zz atoms are not put in a template to
+    # give the same members as run()
+    neighbour = atom.GetNeighbors()[0]
+    if neighbour.GetChiralTag() != Chem.ChiralType.CHI_UNSPECIFIED:
+        return True
+    return any(bond.GetStereo() != Chem.BondStereo.STEREONONE
+               or bond.GetBondDir() in (Chem.BondDir.ENDUPRIGHT,
+                                        Chem.BondDir.ENDDOWNRIGHT)
+               for bond in neighbour.GetBonds())
+
+def render_substituent(mol):
+
+    """ This function writes an R group (the molecule of Label.fragment)
+        as a smiles starting with the bond to the core ("-" or a
+        directional bond), from the atom bonded to its Te, or from its
+        only atom. It returns None if the substituent can't be put in a
+        template (Te atoms other than the one replaced, a Te not bonded by
+        one single bond, see stereo_neighbour...). """
+
+    te = [atom.GetIdx() for atom in mol.GetAtoms() if atom.GetAtomicNum() == 52]
+    if len(te) == 0:
+        if mol.GetNumAtoms() != 1:
+            return None
+        return "-" + Chem.MolToSmiles(mol)
+    if len(te) != 1:
+        return None
+    atom = mol.GetAtomWithIdx(te[0])
+    bonds = atom.GetBonds()
+    if len(bonds) != 1 or bonds[0].GetBondType() != Chem.BondType.SINGLE:
+        return None
+    if stereo_neighbour(atom):
+        return None
+    # double bonds written as in the molecules of run() (see
+    # Label.sanitize)
+    mol = Chem.Mol(mol)
+    clear_bond_stereo(mol)
+    smiles = Chem.MolToSmiles(mol, rootedAtAtom=te[0])
+    if not smiles.startswith("[") or smiles.find(".") != -1:
+        return None
+    # remove the Te atom written first
+    smiles = smiles[smiles.index("]")+1:]
+    if smiles[:1] in ("/", "\\"):
+        return smiles
+    if smiles[:1] in BONDS:
+        return None
+    return "-" + smiles
+
+class Template(object):
+
+    """ Smiles template of a markinchi with only R group blocks (see
+        compile): parts holds the pieces of the smiles of the core between
+        the slots (a slot for the Zz of every block), order the block of
+        every slot in the order they are written and substituents holds
+        for every block the smiles of its substituents (see
+        render_substituent), with ring bond numbers of their own.
+        Iterating over it (or expand(prefix)) yields the output of every
+        combination in the order of MarkInChI.run(). """
+
+    def __init__(self, inchi_obj, parts, order, substituents):
+
+        self.inchi_obj = inchi_obj
+        self.parts = parts
+        self.order = order
+        self.substituents = substituents
+
+    @classmethod
+    def compile(cls, inchi_obj):
+
+        # Template of a MarkInChI, None if it has a block that is not an R
+        # group or if its core or a substituent can't be written as one
+        blocks = inchi_obj.plan.blocks
+        if len(blocks) == 0 or any(block.kind != "R group" for block in blocks):
+            return None
+        mol = Chem.RWMol(inchi_obj.core_mol)
+        label = inchi_obj.label
+        te = [atom for atom in mol.GetAtoms() if atom.GetAtomicNum() == 52]
+        if len(te) != len(blocks) or len(te) == mol.GetNumAtoms():
+            return None
+        for atom in te:
+            if (atom.GetDegree() != 1 or atom.GetNeighbors()[0].GetAtomicNum() == 52
+                    or atom.GetBonds()[0].GetBondType() != Chem.BondType.SINGLE
+                    or stereo_neighbour(atom)):
+                return None
+        # the blocks replace the Te atoms from the lowest label (see
+        # Label.get_index)
+        te.sort(key=lambda atom: (label.core_label(atom), atom.GetIdx()))
+        for atom in mol.GetAtoms():
+            atom.SetAtomMapNum(0)
+        for slot, atom in enumerate(te):
+            atom.SetIsotope(0)
+            atom.SetNoImplicit(True)
+            atom.SetNumExplicitHs(0)
+            atom.SetAtomMapNum(slot+1)
+        # labels left on the other atoms are reset as Label.sanitize does
+        mol = label.sanitize(mol, in_place=True)
+        root = next(atom.GetIdx() for atom in mol.GetAtoms()
+                    if atom.GetAtomicNum() != 52)
+        smiles = Chem.MolToSmiles(mol, rootedAtAtom=root)
+        pieces = SLOT.split(smiles)
+        parts = pieces[0::2]
+        order = [int(slot)-1 for slot in pieces[1::2]]
+        if sorted(order) != list(range(len(te))):
+            return None
+        if any(part[-1:] in BONDS for part in parts[:-1]):
+            return None
+        substituents = []
+        for slot, block in enumerate(blocks):
+            offset = (slot+1)*RING_OFFSET
+            rendered = []
+            for substitution in block.substitutions:
+                substituent = substitution.substituent
+                if substituent.is_hydrogen:
+                    rendered.append("-[H]")
+                    continue
+                smiles = render_substituent(label.fragment(substituent.fragment)[0])
+                if smiles is None:
+                    return None
+                rendered.append(renumber_rings(smiles, offset))
+            substituents.append(rendered)
+        logger.debug("template: %s", "{}".join(parts))
+        return cls(inchi_obj, parts, order, substituents)
+
+    def smiles(self, choices):
+
+        # Smiles of the combination of the index of the substitution used
+        # in every block
+        pieces = [self.parts[0]]
+        for block, part in zip(self.order, self.parts[1:]):
+            pieces.append(self.substituents[block][choices[block]])
+            pieces.append(part)
+        return "".join(pieces)
+
+    def expand(self, prefix=()):
+
+        """ This generator yields the output (see MarkInChI.convert) of
+            every combination starting with the substitutions in prefix,
+            in the order of MarkInChI.run(), duplicates included. A member
+            RDKit can't read from its smiles is made on the molecules (see
+            MarkInChI.combination). """
+
+        inchi_obj = self.inchi_obj
+        ranges = [range(len(grouplist)) for grouplist in inchi_obj.grouplists]
+        ranges[:len(prefix)] = [(choice,) for choice in prefix]
+        for choices in itertools.product(*ranges):
+            if inchi_obj.is_skipped(choices):
+                continue
+            smiles = self.smiles(choices)
+            new_mol = Chem.MolFromSmiles(smiles)
+            if new_mol is None:
+                yield inchi_obj.combination(choices)
+            else:
+                if smiles.find("/") != -1 or smiles.find("\\") != -1:
+                    # double bonds as the molecules of run() have them
+                    clear_bond_stereo(new_mol)
+                yield inchi_obj.convert(new_mol)
+
+    def __iter__(self):
+
+        return self.expand()
@@ -0,0 +1,5 @@
+import os, sys
+
+# The modules of MarkInChI import each other by name (as when they are run
+# from this folder)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
@@ -0,0 +1,31 @@
+import pytest
+from label import isotope_masses
+from markinchi import MarkInChI
+
+def test_isotope_masses():
+    inchi = "InChI=1S/C6H5Cl/c7-6-4-2-1-3-5-6/h1-5H/i4+1,7-2"
+    assert isotope_masses(inchi) == {4: 13, 7: 33}
+
+# chlorobenzene with a 13C (or 11C) at rank 4, with an O or N on the
+# hydrogen of rank 2 or 4: the isotope stays on its atom
+CORE = "MarkInChI=1B/C6H5Cl/c7-6-4-2-1-3-5-6/h1-5H/i4"
+
+@pytest.mark.parametrize("labelling", ["isotope", "map"])
+@pytest.mark.parametrize("shift", ["+1", "-1"])
+def test_shift_of_an_attachment_atom(shift, labelling):
+    members = MarkInChI(CORE+shift+"<M>2H,4H-O!N",
+                        labelling=labelling).list_of_inchi
+    assert members == [
+        "InChI=1S/C6H5ClO/c7-5-2-1-3-6(8)4-5/h1-4,8H/i4"+shift,
+        "InChI=1S/C6H6ClN/c7-5-2-1-3-6(8)4-5/h1-4H,8H2/i4"+shift,
+        "InChI=1S/C6H5ClO/c7-5-3-1-2-4-6(5)8/h1-4,8H/i6"+shift,
+        "InChI=1S/C6H6ClN/c7-5-3-1-2-4-6(5)8/h1-4H,8H2/i6"+shift]
+
+@pytest.mark.parametrize("shift", ["+1", "-1"])
+def test_shift_with_a_group_attached(shift):
+    members = MarkInChI(CORE+shift+"<M>4H,5H-C2H5Zz/c1-2-3/h2H2,1H3!N").list_of_inchi
+    assert members == [
+        "InChI=1S/C8H9Cl/c1-2-7-5-3-4-6-8(7)9/h3-6H,2H2,1H3/i7"+shift,
+        "InChI=1S/C6H6ClN/c7-5-3-1-2-4-6(5)8/h1-4H,8H2/i6"+shift,
+        "InChI=1S/C8H9Cl/c1-2-7-5-3-4-6-8(7)9/h3-6H,2H2,1H3/i6"+shift,
+        "InChI=1S/C6H6ClN/c7-5-3-1-2-4-6(5)8/h1-4H,8H2/i3"+shift]
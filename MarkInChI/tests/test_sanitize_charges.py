@@ -0,0 +1,99 @@
+import os
+import numpy
+import pytest
+from rdkit import Chem, RDLogger
+from label import Label
+from markinchi import MarkInChI
+
+RDLogger.DisableLog("rdApp.*")
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), "..", "Examples")
+FILES = [os.path.join(EXAMPLES, "MarkInChI Examples.txt"),
+         os.path.join(EXAMPLES, "Markush 2000V Mol Examples",
+                      "Reference_MarkInChIs.txt")]
+
+# Markinchis with charged and heteroatom substituents on the atoms of a
+# benzene and a pyridine core (R groups are attached without
+# sanitize_charges)
+SUBSTITUENTS = [
+    "MarkInChI=1S/C6H5Cl/c7-6-4-2-1-3-5-6/h1-5H<M>2H,3H-CH3OZz/c1-2-3/h1H3"
+    "!C2H6NZz/c1-3(2)4/h1-2H3!NO2Zz/c2-1(3)4!N!O!S!P!B",
+    "MarkInChI=1S/C5H5N/c1-2-4-6-5-3-1/h1-5H<M>2H,3H-NO2Zz/c2-1(3)4!N!O!S!B",
+    "MarkInChI=1S/C5H5N/c1-2-4-6-5-3-1/h1-5H<M>6-C!N!O!S!P!B",
+]
+
+# Molecules read without sanitisation, with heteroatoms in valences that
+# leave a charge or not
+HETEROATOMS = ["CN(C)(C)C", "O=N(=O)c1ccccc1", "[O]C(C)=O", "CO(C)C",
+               "CS(C)(=O)=O", "CP(C)(C)C", "CB(C)(C)C", "C[N]C", "Cl(C)C"]
+
+def per_atom_charges(mol):
+
+    # sanitize_charges as it was before it used arrays, one atom at a time
+    mol.UpdatePropertyCache(strict=False)
+    table = Chem.GetPeriodicTable()
+    for atom in mol.GetAtoms():
+        atomic_number = atom.GetAtomicNum()
+        valence = atom.GetTotalValence()
+        electrons = table.GetNOuterElecs(atomic_number)
+        num = (electrons-valence)
+        charge = int((num%2)*numpy.sign(num))
+        if atom.GetSymbol() != "C":
+            atom.SetFormalCharge(charge)
+    return mol
+
+def load_markinchis(path):
+
+    markinchis = []
+    with open(path) as file:
+        for line in file:
+            index = line.find("MarkInChI=")
+            if index != -1:
+                markinchis.append(line[index:].split()[0])
+    return markinchis
+
+def expanded_molecules(markinchi):
+
+    # Copies of the molecules given to sanitize_charges by the expansion
+    molecules = []
+    inchi_obj = MarkInChI(markinchi, lazy=True, template=False)
+    sanitize_charges = inchi_obj.label.sanitize_charges
+    def kept(mol):
+        molecules.append(Chem.Mol(mol))
+        return sanitize_charges(mol)
+    inchi_obj.label.sanitize_charges = kept
+    list(inchi_obj.iter_inchis())
+    return molecules
+
+def charges(mol):
+
+    return [atom.GetFormalCharge() for atom in mol.GetAtoms()]
+
+def check(molecules):
+
+    for mol in molecules:
+        new_mol = Label().sanitize_charges(Chem.Mol(mol))
+        old_mol = per_atom_charges(Chem.Mol(mol))
+        assert charges(new_mol) == charges(old_mol), Chem.MolToSmiles(old_mol)
+
+@pytest.mark.parametrize("path", FILES)
+def test_examples(path):
+    molecules = []
+    for markinchi in load_markinchis(path):
+        molecules += expanded_molecules(markinchi)
+    assert len(molecules) > 0
+    check(molecules)
+
+@pytest.mark.parametrize("markinchi", SUBSTITUENTS)
+def test_substituents(markinchi):
+    molecules = expanded_molecules(markinchi)
+    assert len(molecules) > 0
+    check(molecules)
+
+def test_heteroatoms():
+    molecules = [Chem.MolFromSmiles(smiles, sanitize=False)
+                 for smiles in HETEROATOMS]
+    check(molecules)
+    # some of them are charged
+    assert any(any(charges(Label().sanitize_charges(Chem.Mol(mol))))
+               for mol in molecules)
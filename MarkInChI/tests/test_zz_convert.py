@@ -0,0 +1,30 @@
+import pytest
+from zz_convert import zz_convert
+
+# (inchi with Zz, inchi with one TeH in place of every Zz)
+PAIRS = [
+    ("InChI=1S/C6H5Zz/c7-6-4-2-1-3-5-6/h1-5H",
+     "InChI=1S/C6H6Te/c7-6-4-2-1-3-5-6/h1-5,7H"),
+    ("InChI=1S/C6H4Zz2/c7-5-3-1-2-4-6(5)8/h1-4H",
+     "InChI=1S/C6H6Te2/c7-5-3-1-2-4-6(5)8/h1-4,7-8H"),
+    ("InChI=1S/CHF2OZz/c2-1(3,4)5/h4H",
+     "InChI=1S/CH2F2OTe/c2-1(3,4)5/h4-5H"),
+    # no hydrogen but the one of Te: "H" in the formula, no /h with Zz
+    ("InChI=1S/CF3Zz/c2-1(3,4)5",
+     "InChI=1S/CHF3Te/c2-1(3,4)5/h5H"),
+    ("InChI=1S/C2F5Zz/c3-1(4,5)2(6,7)8",
+     "InChI=1S/C2HF5Te/c3-1(4,5)2(6,7)8/h8H"),
+]
+
+@pytest.mark.parametrize("zz, te", PAIRS)
+def test_zz_to_te(zz, te):
+    assert zz_convert().zz_to_te(zz) == te
+
+@pytest.mark.parametrize("zz, te", PAIRS)
+def test_te_to_zz(zz, te):
+    assert zz_convert().te_to_zz(te) == zz
+
+def test_te_to_zz_without_hydrogen():
+    # a Te with no hydrogen to remove is inconsistent input
+    with pytest.raises(ValueError):
+        zz_convert().te_to_zz("InChI=1S/C2F6Te/c3-1(4,5)9-2(6,7)8")
@@ -0,0 +1,252 @@
+# This module checks the syntax of a markinchi before it is expanded, so
+# malformed input is rejected with the position of the error before the
+# core is parsed and RDKit is used. It only works on strings and doesn't
+# import RDKit (nor the other modules of the package), e.g.
+#     python validate.py "MarkInChI=1B/..."
+
+PREFIX = "MarkInChI=1"
+SEPARATOR = "<M>"
+
+# Symbols of the elements (Zz is the attachment point of the R groups)
+ELEMENTS = frozenset("""
+    H He Li Be B C N O F Ne Na Mg Al Si P S Cl Ar K Ca Sc Ti V Cr Mn Fe Co
+    Ni Cu Zn Ga Ge As Se Br Kr Rb Sr Y Zr Nb Mo Tc Ru Rh Pd Ag Cd In Sn Sb
+    Te I Xe Cs Ba La Ce Pr Nd Pm Sm Eu Gd Tb Dy Ho Er Tm Yb Lu Hf Ta W Re
+    Os Ir Pt Au Hg Tl Pb Bi Po At Rn Fr Ra Ac Th Pa U Np Pu Am Cm Bk Cf Es
+    Fm Md No Lr Rf Db Sg Bh Hs Mt Ds Rg Cn Nh Fl Mc Lv Ts Og Zz""".split())
+# Characters of the content of an inchi layer ("c1-2-3", "h2H2,1H3"...)
+LAYER = frozenset("0123456789,;-+()*?.abcdefghijklmnopqrstuvwxyz"
+                  "ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+
+class MarkInChISyntaxError(ValueError):
+
+    """ Error of the syntax of a markinchi: message says what is wrong and
+        position is the index of the first character concerned in the
+        markinchi (str() gives both). """
+
+    def __init__(self, message, position, markinchi=""):
+
+        ValueError.__init__(self, f"{message} at position {position}")
+        self.message = message
+        self.position = position
+        self.markinchi = markinchi
+
+    def pointer(self):
+
+        # The markinchi with a caret under the error
+        return self.markinchi + "\n" + " "*self.position + "^"
+
+class Validator(object):
+
+    """ Checker of the grammar of a markinchi:
+            markinchi = "MarkInChI=1" ["S"|"B"] "/" inchi ("<M>" block)+
+            block     = R group       e.g. "C!Cl!H"
+                      | list of atoms e.g. "1-C!N"
+                      | variable attachment e.g. "1H,2H,4H-C!N" or "2,3,5-C!N"
+        where the substituents of the blocks are "H", element symbols or
+        part-inchis with a Zz atom ("C2H5Zz/c1-2-3/h2H2,1H3", only in R
+        groups and attachments on hydrogens) and the ranks are those of
+        the atoms of the core. Blocks are told apart as in plan.Plan. """
+
+    def __init__(self, markinchi):
+
+        self.markinchi = markinchi
+        self.atoms = 0  # number of atoms (not H) of the core
+        self.zz = False  # True if the core has a Zz atom
+
+    def error(self, message, position):
+
+        raise MarkInChISyntaxError(message, position, self.markinchi)
+
+    def validate(self):
+
+        markinchi = self.markinchi
+        if not markinchi.startswith(PREFIX):
+            position = 0
+            while (position < len(markinchi) and position < len(PREFIX)
+                   and markinchi[position] == PREFIX[position]):
+                position += 1
+            self.error(f"expected {PREFIX!r}", position)
+        start = len(PREFIX)
+        if markinchi[start:start+1] in ("S", "B"):
+            start += 1
+        parts = markinchi[start:].split(SEPARATOR)
+        if len(parts) == 1:
+            self.error(f"no {SEPARATOR} block", len(markinchi))
+        if not parts[0].startswith("/"):
+            self.error("expected '/' after the version", start)
+        formula = self.inchi(parts[0][1:], start+1)
+        self.atoms, self.zz = self.count_atoms(formula)
+        start += len(parts[0])
+        for block in parts[1:]:
+            start += len(SEPARATOR)
+            self.block(block, start)
+            start += len(block)
+
+    def inchi(self, text, start):
+
+        # Check the formula and layers of an inchi without its prefix,
+        # returning the formula
+        layers = text.split("/")
+        self.formula(layers[0], start)
+        position = start+len(layers[0])
+        for layer in layers[1:]:
+            position += 1
+            if layer == "":
+                self.error("empty layer", position)
+            if not layer[0].islower():
+                self.error(f"unexpected layer {layer[0]!r}", position)
+            for offset, char in enumerate(layer):
+                if char not in LAYER:
+                    self.error(f"unexpected character {char!r}",
+                               position+offset)
+            position += len(layer)
+        return layers[0]
+
+    def formula(self, formula, start):
+
+        # Check a Hill formula ("C10H13ClZz2", "2C2H6.ClH"...)
+        if formula == "":
+            self.error("empty formula", start)
+        for component in formula.split("."):
+            index = 0
+            while index < len(component) and component[index].isdigit():
+                index += 1
+            if index == len(component):
+                self.error("expected an element", start+index)
+            while index < len(component):
+                end = self.element(component, index, start)
+                while end < len(component) and component[end].isdigit():
+                    end += 1
+                index = end
+            start += len(component)+1
+
+    def element(self, text, index, start):
+
+        # Check the element symbol at text[index], returning its end
+        if not text[index].isupper():
+            self.error(f"expected an element, found {text[index]!r}",
+                       start+index)
+        end = index+1
+        while end < len(text) and text[end].islower():
+            end += 1
+        if text[index:end] not in ELEMENTS:
+            self.error(f"unknown element {text[index:end]!r}", start+index)
+        return end
+
+    def count_atoms(self, formula):
+
+        # Number of atoms (not H) of the first component of the formula (the
+        # ranks of the core, see layers.atom_table) and whether it has Zz
+        atoms = 0
+        zz = False
+        component = formula.split(".")[0].lstrip("0123456789")
+        index = 0
+        while index < len(component):
+            end = index+1
+            while end < len(component) and component[end].islower():
+                end += 1
+            element = component[index:end]
+            index = end
+            while end < len(component) and component[end].isdigit():
+                end += 1
+            if element != "H":
+                atoms += int(component[index:end]) if end > index else 1
+            zz = zz or element == "Zz"
+            index = end
+        return atoms, zz
+
+    def block(self, block, start):
+
+        # Check a block, told apart from the text before its first "!" and
+        # "/" as plan.Plan.parse_block does
+        if block == "":
+            self.error("empty block", start)
+        molecule = block.split("!")[0].split("/")[0]
+        if "-" not in molecule:
+            if "," in molecule:
+                self.error("expected '-' after the attachments",
+                           start+len(molecule))
+            if not self.zz:
+                self.error("R group block but the core has no Zz atom",
+                           start)
+            self.substituents(block, start, True)
+            return
+        index = block.index("-")
+        ranks = block[:index].split(",")
+        position = start
+        hydrogens = []
+        for rank in ranks:
+            hydrogen = rank.endswith("H")
+            number = rank[:-1] if hydrogen else rank
+            self.rank(number, position)
+            if len(hydrogens) > 0 and hydrogen != hydrogens[0]:
+                self.error("attachments mix atoms and hydrogens", position)
+            hydrogens.append(hydrogen)
+            position += len(rank)+1
+        if len(ranks) == 1 and hydrogens[0]:
+            self.error("attachment on a hydrogen of only one atom", start)
+        self.substituents(block[index+1:], start+index+1, hydrogens[0])
+
+    def rank(self, number, position):
+
+        # Check the rank of an atom of the core
+        if number == "":
+            self.error("expected a rank", position)
+        for offset, char in enumerate(number):
+            if not char.isdigit():
+                self.error(f"expected a rank, found {char!r}",
+                           position+offset)
+        if number[0] == "0":
+            self.error(f"invalid rank {number!r}", position)
+        if int(number) > self.atoms:
+            self.error(f"rank {number} above the {self.atoms} atoms of "
+                       f"the core", position)
+
+    def substituents(self, text, start, groups):
+
+        # Check the "!"-separated substituents of a block: "H", element
+        # symbols and, if groups is True, part-inchis with a Zz atom
+        position = start
+        for item in text.split("!"):
+            if item == "":
+                self.error("empty substituent", position)
+            if "/" in item:
+                if not groups:
+                    self.error("part-inchi in place of an atom", position)
+                formula = self.inchi(item, position)
+                if "Zz" not in formula:
+                    self.error("part-inchi without a Zz atom", position)
+            else:
+                end = self.element(item, 0, position)
+                if end != len(item):
+                    self.error("expected one atom or a part-inchi", position)
+            position += len(item)+1
+
+def validate(markinchi):
+
+    """ This function raises a MarkInChISyntaxError (a ValueError) giving
+        the position of the first syntax error of markinchi, if it has
+        one (see Validator). """
+
+    Validator(markinchi).validate()
+
+def is_valid(markinchi):
+
+    # True if markinchi has no syntax error
+    try:
+        validate(markinchi)
+    except MarkInChISyntaxError:
+        return False
+    return True
+
+if __name__ == "__main__":
+    import sys
+    markinchi = sys.argv[1] if len(sys.argv) > 1 else input("Please enter the MarkInChI: ")
+    try:
+        validate(markinchi)
+        print("Valid")
+    except MarkInChISyntaxError as error:
+        print(error)
+        print(error.pointer())
+        sys.exit(1)
@@ -3,6 +3,17 @@ from rdkit import Chem
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'new_markinchi'))
 from helper import helper
+from layers import InChILayers
+
+def hydrogens(count):
+
+    # Hydrogens of a formula as InChI writes them ("H2", "H" for one, ""
+    # for none)
+    if count == 0:
+        return ""
+    if count == 1:
+        return "H"
+    return "H"+str(count)
 
 class zz_convert(object):
 
@@ -13,16 +24,15 @@ class zz_convert(object):
 
         # TODO: replace Zz with Te
         new_inchi = inchi.replace("Zz", "Te")
+        layers = InChILayers(new_inchi)
 
         # TODO: determine ranking of zz atoms
         no, start_zz = self.helper.zz_no(new_inchi)
 
         # TODO: add one hydrogen to each Te using the hydrogen layer
-        index = new_inchi.find("/h")
-        h_layer = ""
-        if index != -1:
+        h_layer = layers.layer("h")
+        if h_layer is not None:
             # find "H," or "H/" and see the number before
-            h_layer = new_inchi.split("/h")[1].split("/")[0]
             if h_layer.find("H,") != -1:
                 in_index = h_layer.find("H,")
                 _index = h_layer[:in_index].rfind("-")
@@ -66,24 +76,15 @@ class zz_convert(object):
                     else:
                         h_layer = str(start_zz)+","+h_layer
 
-            if new_inchi.split("/h")[1].find("/") != -1:
-                suf = "/"+"/".join(new_inchi.split("/h")[1].split("/")[1:])
-                new_inchi = new_inchi[:index+2]+h_layer+suf
-            else:
-                new_inchi = new_inchi[:index+2]+h_layer
+            layers.set_layer("h", h_layer)
         else:
             if no > 1:
-                h_layer = "/h"+str(start_zz)+"-"+str(start_zz+no-1)+"H"
+                h_layer = str(start_zz)+"-"+str(start_zz+no-1)+"H"
             else:
-                h_layer = "/h"+str(start_zz)+"H"
-            if new_inchi.split("/c")[1].find("/") != -1:
-                index1 = new_inchi.find("/c")
-                indexf = new_inchi[index1+1:].find("/")
-                indexf += index1+1
-                new_inchi = new_inchi[:indexf]+h_layer+new_inchi[indexf:]
-            else:
-                new_inchi += h_layer
-        formula = new_inchi.split("/")[1]
+                h_layer = str(start_zz)+"H"
+            # the hydrogen layer follows the connections
+            layers.set_layer("h", h_layer, after=("c",))
+        formula = layers.formula
         index0 = formula.find("H")
         num = no
         if index0 != -1:
@@ -96,18 +97,18 @@ class zz_convert(object):
                 num += 1
             else:
                 num += int(formula[index0+1:index0+indexf])
-            formula = formula[:index0+1]+str(num)+formula[index0+indexf:]
-            new_inchi = new_inchi.split("/")[0]+"/"+formula+"/"+"/".join(new_inchi.split("/")[2:])
+            formula = formula[:index0]+hydrogens(num)+formula[index0+indexf:]
         else:
             indexc = formula.find("C")
             indexf = indexc+1
             for char in formula[indexc+1:]:
-                if char.is_alpha():
+                if char.isalpha():
                     break
                 indexf += 1
-            sub = "H"+str(no)
+            sub = hydrogens(no)
             formula = formula[:indexf]+sub+formula[indexf:]
-        return new_inchi
+        layers.formula = formula
+        return str(layers)
 
 
     def h_operations(self, number, start_zz, no, in_index, _index, h_layer):
@@ -148,10 +149,9 @@ class zz_convert(object):
         no, start_zz = self.helper.zz_no(inchi)
 
         # TODO: remove one hydrogen from each Te using the hydrogen layer
-        index = new_inchi.find("/h")
-        h_layer = ""
-        if index != -1:
-            h_layer = new_inchi.split("/h")[1].split("/")[0]
+        layers = InChILayers(new_inchi)
+        h_layer = layers.layer("h")
+        if h_layer is not None:
             if h_layer.find("H,") != -1:
                 in_index = h_layer.find("H,")
                 _index = h_layer[:in_index].rfind("-")
@@ -237,12 +237,12 @@ class zz_convert(object):
                             number = h_layer[:in_index]
                             if int(number) == start_zz:
                                 h_layer = ""
-            if new_inchi.split("/h")[1].find("/") != -1:
-                suf = "/"+"/".join(new_inchi.split("/h")[1].split("/")[1:])
-                new_inchi = new_inchi[:index+2]+h_layer+suf
+            if h_layer == "":
+                # only the Te atoms had hydrogens
+                layers.remove_layer("h")
             else:
-                new_inchi = new_inchi[:index+2]+h_layer
-        formula = new_inchi.split("/")[1]
+                layers.set_layer("h", h_layer)
+        formula = layers.formula
         index0 = formula.find("H")
         num = no*-1
         if index0 != -1:
@@ -255,18 +255,13 @@ class zz_convert(object):
                 num += 1
             else:
                 num += int(formula[index0+1:index0+indexf])
-            formula = formula[:index0+1]+str(num)+formula[index0+indexf:]
-            new_inchi = new_inchi.split("/")[0]+"/"+formula+"/"+"/".join(new_inchi.split("/")[2:])
-        else:
-            indexc = formula.find("C")
-            indexf = indexc+1
-            for char in formula[indexc+1:]:
-                if char.is_alpha():
-                    break
-                indexf += 1
-            sub = "H"+str(no)
-            formula = formula[:indexf]+sub+formula[indexf:]
-        return new_inchi
+            formula = formula[:index0]+hydrogens(num)+formula[index0+indexf:]
+        elif no > 0:
+            # the Te atoms have no hydrogen to remove
+            raise ValueError(f"no hydrogen in the formula of {inchi} to remove "
+                             f"from its {no} Te atoms")
+        layers.formula = formula
+        return str(layers)
 
 if __name__ == "__main__":
     inchi = input("Please enter the inchi with Zz:")